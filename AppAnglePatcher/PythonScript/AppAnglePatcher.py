@@ -12,10 +12,1078 @@ import plistlib
 import argparse
 import subprocess
 import re
+import time
+import ctypes
+import ctypes.util
+import json
+import glob
+import fnmatch
+import functools
+import shlex
+import tempfile
+import hashlib
+import mmap
+import struct
+import threading
+import contextlib
+import gc
+import posixpath
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Set
 
 
+class IOThrottle:
+    """Ограничение скорости и IOPS для копирования и удаления файлов"""
+    
+    CHUNK_SIZE = 1024 * 1024
+    # Задержки ниже этого порога (сек) не считаются признаком конкуренции за диск
+    CONTENTION_FLOOR = 0.005
+    
+    def __init__(self, max_mbps: float = 0, max_iops: float = 0, adaptive: bool = False):
+        self.max_bytes_per_sec = max_mbps * 1024 * 1024 if max_mbps > 0 else 0
+        self.max_iops = max_iops if max_iops > 0 else 0
+        self.adaptive = adaptive
+        
+        # Корзины токенов: [доступно, время последнего пополнения]
+        self._byte_bucket = [self.max_bytes_per_sec, time.monotonic()]
+        self._op_bucket = [self.max_iops, time.monotonic()]
+        
+        # Состояние адаптивного режима: базовая задержка и текущий коэффициент
+        self._baseline = None
+        self._factor = 1.0
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_bytes_per_sec or self.max_iops or self.adaptive)
+    
+    def _take(self, bucket: list, amount: float, limit: float):
+        """Списание из корзины токенов с ожиданием, если токенов не хватает"""
+        if not limit:
+            return
+        rate = limit * self._factor
+        now = time.monotonic()
+        # Пополняем корзину, но не больше чем на одну секунду вперед
+        bucket[0] = min(bucket[0] + (now - bucket[1]) * rate, rate)
+        bucket[1] = now
+        bucket[0] -= amount
+        if bucket[0] < 0:
+            time.sleep(-bucket[0] / rate)
+    
+    def consume_bytes(self, nbytes: int):
+        """Учет записанных байт с ожиданием при превышении лимита"""
+        self._take(self._byte_bucket, nbytes, self.max_bytes_per_sec)
+    
+    def consume_op(self):
+        """Учет одной файловой операции с ожиданием при превышении IOPS"""
+        self._take(self._op_bucket, 1, self.max_iops)
+    
+    def observe(self, elapsed: float, nbytes: int = 0):
+        """Адаптивный режим: замедление при росте задержки операций"""
+        if not self.adaptive:
+            return
+        # Нормируем задержку на мегабайт, чтобы мелкие и крупные операции были сравнимы
+        cost = elapsed / max(nbytes / self.CHUNK_SIZE, 1.0)
+        if self._baseline is None:
+            self._baseline = cost
+            return
+        if cost > self._baseline * 2 and cost > self.CONTENTION_FLOOR:
+            # Диск занят - снижаем темп
+            self._factor = max(self._factor * 0.5, 0.05)
+        else:
+            self._factor = min(self._factor * 1.05, 1.0)
+            self._baseline = min(self._baseline, cost) * 0.9 + cost * 0.1
+        # Без явных лимитов уступаем диск паузой пропорционально замедлению
+        if self._factor < 1.0 and not (self.max_bytes_per_sec or self.max_iops):
+            time.sleep(elapsed * (1.0 / self._factor - 1.0))
+    
+    def copy_file(self, src, dst, *, follow_symlinks=True):
+        """Копирование файла блоками с учетом лимитов (copy_function для copytree)"""
+        if not follow_symlinks and os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            return dst
+        self.consume_op()
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            while True:
+                started = time.monotonic()
+                chunk = fsrc.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                self.observe(time.monotonic() - started, len(chunk))
+                self.consume_bytes(len(chunk))
+        shutil.copystat(src, dst, follow_symlinks=follow_symlinks)
+        return dst
+    
+    def rmtree(self, path: Path):
+        """Удаление дерева с ограничением IOPS"""
+        for root, dirs, files in os.walk(path, topdown=False):
+            for name in files:
+                started = time.monotonic()
+                os.unlink(os.path.join(root, name))
+                self.observe(time.monotonic() - started)
+                self.consume_op()
+            for name in dirs:
+                full = os.path.join(root, name)
+                started = time.monotonic()
+                if os.path.islink(full):
+                    os.unlink(full)
+                else:
+                    os.rmdir(full)
+                self.observe(time.monotonic() - started)
+                self.consume_op()
+        os.rmdir(path)
+
+
+class FileSystem(ABC):
+    """
+    Интерфейс файловых операций, которые использует патчер
+    Пути принимаются как str или Path
+    """
+    
+    # Имеет ли смысл распараллеливать операции (ожидание диска), или потоки только мешают друг другу
+    concurrent = True
+    
+    @abstractmethod
+    def exists(self, path) -> bool:
+        raise NotImplementedError
+    
+    @abstractmethod
+    def is_dir(self, path, follow_symlinks: bool = True) -> bool:
+        raise NotImplementedError
+    
+    @abstractmethod
+    def listdir(self, path) -> List[str]:
+        raise NotImplementedError
+    
+    @abstractmethod
+    def list_subdirs(self, path, follow_symlinks: bool = False) -> List[str]:
+        """Полные пути поддиректорий (без рекурсии)"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def walk(self, path):
+        """Обход дерева сверху вниз, как os.walk (без перехода по ссылкам)"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def stat(self, path, follow_symlinks: bool = True):
+        """Результат с полями st_ino, st_size, st_mtime_ns, st_mode"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def realpath(self, path) -> str:
+        raise NotImplementedError
+    
+    def samefile(self, path1, path2) -> bool:
+        return self.stat(path1).st_ino == self.stat(path2).st_ino
+    
+    @abstractmethod
+    def read_bytes(self, path) -> bytes:
+        raise NotImplementedError
+    
+    def read_region(self, path, offset: int, length: int) -> bytes:
+        return self.read_bytes(path)[offset:offset + length]
+    
+    def read_plist(self, path) -> Dict:
+        return plistlib.loads(self.read_bytes(path))
+    
+    @abstractmethod
+    def write_bytes(self, path, data: bytes, mode: Optional[int] = None, sync: bool = False):
+        raise NotImplementedError
+    
+    @abstractmethod
+    def mkdir(self, path):
+        """Создание директории вместе с родительскими (если еще нет)"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def rename(self, src, dst):
+        """Переименование с заменой существующего файла (как os.replace)"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def link(self, src, dst):
+        raise NotImplementedError
+    
+    @abstractmethod
+    def unlink(self, path):
+        raise NotImplementedError
+    
+    @abstractmethod
+    def copy_file(self, src, dst):
+        """Копирование файла с метаданными и синхронизацией данных"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def copytree(self, src, dst, throttle: Optional[IOThrottle] = None) -> int:
+        """Копирование дерева, возвращает число скопированных байт"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def rmtree(self, path, throttle: Optional[IOThrottle] = None):
+        raise NotImplementedError
+    
+    def fsync_dir(self, path):
+        pass
+    
+    def glob(self, pattern: str) -> List[str]:
+        """Раскрытие шаблона пути покомпонентно через listdir"""
+        pattern = os.path.abspath(pattern)
+        matches = ["/"]
+        for part in pattern.strip("/").split("/"):
+            next_matches = []
+            for base in matches:
+                if not glob.has_magic(part):
+                    candidate = posixpath.join(base, part)
+                    if self.exists(candidate):
+                        next_matches.append(candidate)
+                    continue
+                try:
+                    names = self.listdir(base)
+                except OSError:
+                    continue
+                next_matches.extend(posixpath.join(base, name) for name in names
+                                    if fnmatch.fnmatch(name, part) and not name.startswith('.'))
+            matches = next_matches
+        return matches
+
+
+class LocalFileSystem(FileSystem):
+    """Файловые операции на реальном диске"""
+    
+    def exists(self, path) -> bool:
+        return os.path.exists(path)
+    
+    def is_dir(self, path, follow_symlinks: bool = True) -> bool:
+        if follow_symlinks:
+            return os.path.isdir(path)
+        return os.path.isdir(path) and not os.path.islink(path)
+    
+    def listdir(self, path) -> List[str]:
+        return os.listdir(path)
+    
+    def list_subdirs(self, path, follow_symlinks: bool = False) -> List[str]:
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=follow_symlinks):
+                        subdirs.append(entry.path)
+                except OSError:
+                    continue
+        return subdirs
+    
+    def walk(self, path):
+        return os.walk(path)
+    
+    def stat(self, path, follow_symlinks: bool = True):
+        return os.stat(path, follow_symlinks=follow_symlinks)
+    
+    def realpath(self, path) -> str:
+        return os.path.realpath(path)
+    
+    def samefile(self, path1, path2) -> bool:
+        return os.path.samefile(path1, path2)
+    
+    def read_bytes(self, path) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+    
+    def read_region(self, path, offset: int, length: int) -> bytes:
+        """Чтение участка файла через mmap только нужных страниц"""
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if offset >= size or length <= 0:
+                return b""
+            length = min(length, size - offset)
+            aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+            with mmap.mmap(f.fileno(), length + offset - aligned, access=mmap.ACCESS_READ, offset=aligned) as region:
+                return region[offset - aligned:]
+    
+    def read_plist(self, path) -> Dict:
+        with open(path, 'rb') as f:
+            return plistlib.load(f)
+    
+    def write_bytes(self, path, data: bytes, mode: Optional[int] = None, sync: bool = False):
+        with open(path, 'wb') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(path, mode)
+    
+    def mkdir(self, path):
+        os.makedirs(path, exist_ok=True)
+    
+    def rename(self, src, dst):
+        os.replace(src, dst)
+    
+    def link(self, src, dst):
+        os.link(src, dst)
+    
+    def unlink(self, path):
+        os.unlink(path)
+    
+    def copy_file(self, src, dst):
+        shutil.copy2(src, dst)
+        with open(dst, 'rb') as f:
+            os.fsync(f.fileno())
+    
+    def copytree(self, src, dst, throttle: Optional[IOThrottle] = None) -> int:
+        copy_file = throttle.copy_file if throttle else shutil.copy2
+        copied = [0]
+        
+        def copy_and_count(src_file, dst_file, *, follow_symlinks=True):
+            result = copy_file(src_file, dst_file, follow_symlinks=follow_symlinks)
+            copied[0] += os.lstat(dst_file).st_size
+            return result
+        
+        shutil.copytree(src, dst, copy_function=copy_and_count)
+        return copied[0]
+    
+    def rmtree(self, path, throttle: Optional[IOThrottle] = None):
+        if throttle:
+            throttle.rmtree(path)
+        else:
+            shutil.rmtree(path)
+    
+    def fsync_dir(self, path):
+        fsync_directory(path)
+    
+    def glob(self, pattern: str) -> List[str]:
+        return glob.glob(pattern)
+
+
+MemoryStat = namedtuple("MemoryStat", ["st_ino", "st_size", "st_mtime_ns", "st_mode"])
+
+
+class _MemoryNode:
+    """Узел дерева MemoryFileSystem: директория, файл или символическая ссылка"""
+    
+    __slots__ = ("kind", "children", "data", "source", "size", "mtime_ns", "mode", "ino", "target", "plist")
+    
+    def __init__(self, kind: str, ino: int, mtime_ns: int, mode: int):
+        self.kind = kind
+        self.children: Optional[Dict[str, "_MemoryNode"]] = {} if kind == "dir" else None
+        # Содержимое файла в памяти или путь на диске, откуда оно читается при необходимости
+        self.data: Optional[bytes] = None
+        self.source: Optional[str] = None
+        self.size = 0
+        self.mtime_ns = mtime_ns
+        self.mode = mode
+        self.ino = ino
+        self.target: Optional[str] = None
+        # Разобранный Info.plist: сканирование читает один и тот же plist несколько раз
+        self.plist: Optional[Dict] = None
+
+
+class MemoryFileSystem(FileSystem):
+    """
+    Файловая система в памяти для планирования, тестов и бенчмарков
+    Все изменения записываются в журнал (journal)
+    """
+    
+    # Операции выполняются под одной блокировкой без ожидания ввода-вывода: пул потоков только замедляет
+    concurrent = False
+    KIND_BITS = {"dir": 0o040000, "file": 0o100000, "link": 0o120000}
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._next_ino = 1
+        self._clock = time.time_ns()
+        self.root = self._new_node("dir", 0o755)
+        self.journal: List[Tuple[str, str]] = []
+    
+    def _new_node(self, kind: str, mode: int, mtime_ns: Optional[int] = None) -> _MemoryNode:
+        node = _MemoryNode(kind, self._next_ino, mtime_ns if mtime_ns is not None else self._now(), mode)
+        self._next_ino += 1
+        return node
+    
+    def _now(self) -> int:
+        # Монотонное время: каждая запись меняет mtime, даже если часы не сдвинулись
+        self._clock = max(time.time_ns(), self._clock + 1)
+        return self._clock
+    
+    @staticmethod
+    def _parts(path) -> List[str]:
+        path = os.fspath(path)
+        # Нормализация нужна только относительным путям и путям с '.', '..' или '//'
+        if not path.startswith("/") or "/." in path or "//" in path:
+            path = os.path.abspath(path)
+        return [part for part in path.split("/") if part]
+    
+    def _resolve(self, path, follow_symlinks: bool = True, depth: int = 0) -> Optional[_MemoryNode]:
+        """Поиск узла по пути; промежуточные ссылки разрешаются всегда"""
+        if depth > 40:
+            raise OSError(f"Too many levels of symbolic links: {path}")
+        parts = self._parts(path)
+        last = len(parts) - 1
+        node = self.root
+        for index, part in enumerate(parts):
+            if node.children is None:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+            if node.kind == "link" and (follow_symlinks or index != last):
+                base = "/" + "/".join(parts[:index])
+                target = posixpath.join(base, node.target)
+                node = self._resolve(target, True, depth + 1)
+                if node is None:
+                    return None
+        return node
+    
+    def _parent(self, path) -> Tuple[_MemoryNode, str]:
+        parts = self._parts(path)
+        if not parts:
+            raise PermissionError(f"Cannot modify root: {path}")
+        parent = self._resolve("/" + "/".join(parts[:-1]))
+        if parent is None:
+            raise FileNotFoundError(f"No such directory: {os.path.dirname(os.fspath(path))}")
+        if parent.kind != "dir":
+            raise NotADirectoryError(f"Not a directory: {os.path.dirname(os.fspath(path))}")
+        return parent, parts[-1]
+    
+    def _get(self, path, follow_symlinks: bool = True) -> _MemoryNode:
+        node = self._resolve(path, follow_symlinks)
+        if node is None:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+        return node
+    
+    def exists(self, path) -> bool:
+        with self._lock:
+            return self._resolve(path) is not None
+    
+    def is_dir(self, path, follow_symlinks: bool = True) -> bool:
+        with self._lock:
+            node = self._resolve(path, follow_symlinks)
+            return node is not None and node.kind == "dir"
+    
+    def listdir(self, path) -> List[str]:
+        with self._lock:
+            node = self._get(path)
+            if node.kind != "dir":
+                raise NotADirectoryError(f"Not a directory: {path}")
+            return list(node.children)
+    
+    def list_subdirs(self, path, follow_symlinks: bool = False) -> List[str]:
+        with self._lock:
+            node = self._get(path)
+            if node.kind != "dir":
+                raise NotADirectoryError(f"Not a directory: {path}")
+            base = os.fspath(path).rstrip("/") + "/"
+            subdirs = []
+            for name, child in node.children.items():
+                full = base + name
+                if child.kind == "dir" or (follow_symlinks and child.kind == "link" and self.is_dir(full)):
+                    subdirs.append(full)
+            return subdirs
+    
+    def walk(self, path):
+        top = os.fspath(path)
+        with self._lock:
+            node = self._resolve(top)
+            if node is None or node.kind != "dir":
+                return
+            dirs, files, links = [], [], set()
+            for name, child in node.children.items():
+                if child.kind == "dir":
+                    dirs.append(name)
+                elif child.kind == "link" and self.is_dir(posixpath.join(top, name)):
+                    # Как os.walk(followlinks=False): ссылка на директорию попадает в dirs, но обход в нее не заходит
+                    dirs.append(name)
+                    links.add(name)
+                else:
+                    files.append(name)
+        yield top, dirs, files
+        for name in dirs:
+            if name not in links:
+                yield from self.walk(posixpath.join(top, name))
+    
+    def stat(self, path, follow_symlinks: bool = True):
+        with self._lock:
+            node = self._get(path, follow_symlinks)
+            size = len(node.target) if node.kind == "link" else node.size
+            return MemoryStat(node.ino, size, node.mtime_ns, self.KIND_BITS[node.kind] | node.mode)
+    
+    def realpath(self, path) -> str:
+        with self._lock:
+            # Один проход от корня; на ссылке путь собирается заново из ее цели
+            resolved = []
+            pending = self._parts(path)
+            pending.reverse()
+            node = self.root
+            hops = 0
+            while pending:
+                part = pending.pop()
+                child = node.children.get(part) if node is not None and node.children is not None else None
+                if child is not None and child.kind == "link" and hops < 40:
+                    hops += 1
+                    target = posixpath.join("/" + "/".join(resolved), child.target)
+                    pending.extend(reversed(self._parts(target)))
+                    resolved = []
+                    node = self.root
+                else:
+                    resolved.append(part)
+                    node = child
+            return "/" + "/".join(resolved)
+    
+    def read_bytes(self, path) -> bytes:
+        with self._lock:
+            node = self._get(path)
+            if node.kind != "file":
+                raise IsADirectoryError(f"Not a file: {path}")
+            data, source = node.data, node.source
+        if data is not None:
+            return data
+        if source is not None:
+            with open(source, 'rb') as f:
+                return f.read()
+        return b""
+    
+    def read_plist(self, path) -> Dict:
+        with self._lock:
+            node = self._get(path)
+            plist_data = node.plist
+        if plist_data is None:
+            plist_data = plistlib.loads(self.read_bytes(path))
+            node.plist = plist_data
+        return dict(plist_data)
+    
+    def read_region(self, path, offset: int, length: int) -> bytes:
+        with self._lock:
+            node = self._get(path)
+            data, source = node.data, node.source
+        if data is None and source is not None:
+            # Для импортированных с диска файлов читаем только нужный участок
+            return LocalFileSystem().read_region(source, offset, length)
+        return (data or b"")[offset:offset + length]
+    
+    def write_bytes(self, path, data: bytes, mode: Optional[int] = None, sync: bool = False):
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is not None and node.kind == "dir":
+                raise IsADirectoryError(f"Is a directory: {path}")
+            if node is None or node.kind == "link":
+                node = self._new_node("file", 0o644)
+                parent.children[name] = node
+            node.data = bytes(data)
+            node.source = None
+            node.plist = None
+            node.size = len(node.data)
+            node.mtime_ns = self._now()
+            if mode is not None:
+                node.mode = mode
+            self.journal.append(("write", os.fspath(path)))
+    
+    def mkdir(self, path):
+        with self._lock:
+            node = self.root
+            current = ""
+            created = False
+            for part in self._parts(path):
+                current += "/" + part
+                child = node.children.get(part)
+                if child is None:
+                    child = self._new_node("dir", 0o755)
+                    node.children[part] = child
+                    created = True
+                elif child.kind == "link":
+                    child = self._get(current)
+                if child.kind != "dir":
+                    raise FileExistsError(f"Not a directory: {path}")
+                node = child
+            if created:
+                self.journal.append(("mkdir", os.fspath(path)))
+    
+    def rename(self, src, dst):
+        with self._lock:
+            src_parent, src_name = self._parent(src)
+            node = src_parent.children.get(src_name)
+            if node is None:
+                raise FileNotFoundError(f"No such file or directory: {src}")
+            dst_parent, dst_name = self._parent(dst)
+            existing = dst_parent.children.get(dst_name)
+            if existing is not None and existing.kind == "dir" and existing.children:
+                raise OSError(f"Directory not empty: {dst}")
+            del src_parent.children[src_name]
+            dst_parent.children[dst_name] = node
+            self.journal.append(("rename", f"{os.fspath(src)} -> {os.fspath(dst)}"))
+    
+    def link(self, src, dst):
+        with self._lock:
+            node = self._get(src)
+            parent, name = self._parent(dst)
+            if name in parent.children:
+                raise FileExistsError(f"File exists: {dst}")
+            parent.children[name] = node
+            self.journal.append(("link", f"{os.fspath(src)} -> {os.fspath(dst)}"))
+    
+    def unlink(self, path):
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is None:
+                raise FileNotFoundError(f"No such file or directory: {path}")
+            if node.kind == "dir":
+                raise IsADirectoryError(f"Is a directory: {path}")
+            del parent.children[name]
+            self.journal.append(("unlink", os.fspath(path)))
+    
+    def _copy_node(self, node: _MemoryNode, counter: List[int]) -> _MemoryNode:
+        """Копия узла как у shutil.copytree: ссылки разыменовываются, mtime сохраняется"""
+        copy = self._new_node(node.kind, node.mode, node.mtime_ns)
+        if node.kind == "dir":
+            for name, child in node.children.items():
+                copy.children[name] = self._copy_node(child, counter)
+        else:
+            # bytes неизменяемы, поэтому содержимое разделяется без копирования
+            copy.data, copy.source, copy.size, copy.plist = node.data, node.source, node.size, node.plist
+            counter[0] += node.size
+        return copy
+    
+    def _copy_resolved(self, path, node: _MemoryNode, counter: List[int]) -> _MemoryNode:
+        if node.kind == "link":
+            node = self._get(path)
+        if node.kind != "dir":
+            return self._copy_node(node, counter)
+        copy = self._new_node("dir", node.mode, node.mtime_ns)
+        for name, child in node.children.items():
+            copy.children[name] = self._copy_resolved(posixpath.join(os.fspath(path), name), child, counter)
+        return copy
+    
+    def copy_file(self, src, dst):
+        with self._lock:
+            node = self._get(src)
+            parent, name = self._parent(dst)
+            parent.children[name] = self._copy_node(node, [0])
+            self.journal.append(("copy", f"{os.fspath(src)} -> {os.fspath(dst)}"))
+    
+    def copytree(self, src, dst, throttle: Optional[IOThrottle] = None) -> int:
+        with self._lock:
+            node = self._get(src)
+            if node.kind != "dir":
+                raise NotADirectoryError(f"Not a directory: {src}")
+            parent, name = self._parent(dst)
+            if name in parent.children:
+                raise FileExistsError(f"File exists: {dst}")
+            counter = [0]
+            parent.children[name] = self._copy_resolved(src, node, counter)
+            self.journal.append(("copytree", f"{os.fspath(src)} -> {os.fspath(dst)}"))
+            return counter[0]
+    
+    def rmtree(self, path, throttle: Optional[IOThrottle] = None):
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is None:
+                raise FileNotFoundError(f"No such file or directory: {path}")
+            if node.kind != "dir":
+                raise NotADirectoryError(f"Not a directory: {path}")
+            del parent.children[name]
+            self.journal.append(("rmtree", os.fspath(path)))
+    
+    def import_from_disk(self, path):
+        """
+        Перенос метаданных дерева с диска; содержимое файлов читается с диска по требованию
+        Импорт не попадает в журнал изменений
+        """
+        path = os.path.abspath(os.path.expanduser(os.fspath(path)))
+        if not os.path.lexists(path) or self.exists(path):
+            return
+        journal_length = len(self.journal)
+        self.mkdir(os.path.dirname(path))
+        # Жесткие ссылки остаются общими узлами
+        inodes: Dict[Tuple[int, int], _MemoryNode] = {}
+        
+        def import_entry(real_path: str, parent: _MemoryNode, name: str):
+            st = os.lstat(real_path)
+            if os.path.islink(real_path):
+                node = self._new_node("link", 0o777, st.st_mtime_ns)
+                node.target = os.readlink(real_path)
+            elif os.path.isdir(real_path):
+                node = self._new_node("dir", st.st_mode & 0o7777, st.st_mtime_ns)
+                try:
+                    names = os.listdir(real_path)
+                except OSError:
+                    names = []
+                for child in names:
+                    import_entry(os.path.join(real_path, child), node, child)
+            else:
+                key = (st.st_dev, st.st_ino)
+                node = inodes.get(key)
+                if node is None:
+                    node = self._new_node("file", st.st_mode & 0o7777, st.st_mtime_ns)
+                    node.source = real_path
+                    node.size = st.st_size
+                    inodes[key] = node
+            parent.children[name] = node
+        
+        with self._lock:
+            parent, name = self._parent(path)
+            import_entry(path, parent, name)
+            del self.journal[journal_length:]
+    
+    def populate_apps(self, directory, count: int, chromium_ratio: float = 0.5):
+        """Генерация count простых .app bundles для моделирования больших парков"""
+        executable_data = b"\xcf\xfa\xed\xfe" + b"\0" * 4092
+        every = max(1, round(1 / chromium_ratio)) if chromium_ratio > 0 else 0
+        # Info.plist собирается по шаблону: plistlib.dumps на каждый bundle заметно дороже
+        template = plistlib.dumps({
+            "CFBundleExecutable": "@NAME@",
+            "CFBundleIdentifier": "com.example.@KIND@.app@INDEX@",
+            "CFBundleVersion": "1",
+            "CFBundleShortVersionString": "1.0"
+        })
+        
+        def add(parent: _MemoryNode, name: str, kind: str, mode: int, data: Optional[bytes] = None,
+                plist_data: Optional[Dict] = None) -> _MemoryNode:
+            node = self._new_node(kind, mode)
+            if data is not None:
+                node.data = data
+                node.size = len(data)
+            node.plist = plist_data
+            parent.children[name] = node
+            return node
+        
+        # Сборщик мусора на миллионах новых узлов тратит больше времени, чем сама генерация
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with self._lock:
+                journal_length = len(self.journal)
+                self.mkdir(directory)
+                apps_dir = self._get(directory)
+                del self.journal[journal_length:]
+                # Узлы создаются напрямую, без разбора путей
+                for index in range(count):
+                    name = f"App {index:06d}"
+                    kind = "electron" if every and index % every == 0 else "native"
+                    plist_data = {
+                        "CFBundleExecutable": name,
+                        "CFBundleIdentifier": f"com.example.{kind}.app{index}",
+                        "CFBundleVersion": "1",
+                        "CFBundleShortVersionString": "1.0"
+                    }
+                    contents = add(add(apps_dir, f"{name}.app", "dir", 0o755), "Contents", "dir", 0o755)
+                    add(contents, "Info.plist", "file", 0o644,
+                        template.replace(b"@NAME@", name.encode()).replace(b"@KIND@", kind.encode())
+                        .replace(b"@INDEX@", str(index).encode()), plist_data)
+                    add(add(contents, "MacOS", "dir", 0o755), name, "file", 0o755, executable_data)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+
+class SearchRoot:
+    """Корневая директория поиска приложений со своими настройками обхода"""
+    
+    def __init__(self, path, max_depth: Optional[int] = None, exclude: Optional[List[str]] = None,
+                 follow_symlinks: bool = False):
+        self.path = Path(os.path.expanduser(str(path)))
+        self.max_depth = max_depth
+        self.exclude = list(exclude or [])
+        self.follow_symlinks = follow_symlinks
+        self._exclude_key: Optional[Tuple[str, ...]] = None
+        self._exclude_re = None
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SearchRoot":
+        return cls(data["path"], data.get("max_depth"), data.get("exclude"),
+                   data.get("follow_symlinks", False))
+    
+    def expand(self, fs: FileSystem) -> List["SearchRoot"]:
+        """Раскрытие шаблонов в пути (например, /Users/*/Applications)"""
+        if not glob.has_magic(str(self.path)):
+            return [self]
+        return [SearchRoot(match, self.max_depth, self.exclude, self.follow_symlinks)
+                for match in sorted(fs.glob(str(self.path)))]
+    
+    def is_excluded(self, path: str) -> bool:
+        if not self.exclude:
+            return False
+        # Шаблоны собираются в одно регулярное выражение; список исключений может дополняться
+        key = tuple(self.exclude)
+        if key != self._exclude_key:
+            self._exclude_re = re.compile("|".join(fnmatch.translate(pattern) for pattern in key))
+            self._exclude_key = key
+        return bool(self._exclude_re.match(path) or self._exclude_re.match(os.path.basename(path)))
+    
+    def walk_bundles(self, fs: FileSystem) -> List[Path]:
+        """Поиск .app bundles с учетом глубины, исключений и политики ссылок"""
+        bundles = []
+        visited = set()
+        stack = [(str(self.path), 0)]
+        
+        while stack:
+            current, depth = stack.pop()
+            if self.follow_symlinks:
+                # Защита от циклов при переходе по символическим ссылкам
+                real = fs.realpath(current)
+                if real in visited:
+                    continue
+                visited.add(real)
+            
+            try:
+                subdirs = fs.list_subdirs(current, self.follow_symlinks)
+            except OSError:
+                continue
+            
+            for subdir in subdirs:
+                # Скрытые директории (например, .generations с поколениями резервных копий) не обходим
+                if os.path.basename(subdir).startswith(".") or self.is_excluded(subdir):
+                    continue
+                if subdir.endswith(".app"):
+                    bundles.append(Path(subdir))
+                # Спускаемся и внутрь .app: Xcode содержит вложенные приложения
+                if self.max_depth is None or depth + 1 < self.max_depth:
+                    stack.append((subdir, depth + 1))
+        
+        return bundles
+
+
+def load_search_roots(config_file: str) -> List[SearchRoot]:
+    """Загрузка корней поиска из JSON: список или {"roots": [...]}"""
+    with open(os.path.expanduser(config_file), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("roots", [])
+    return [SearchRoot(item) if isinstance(item, str) else SearchRoot.from_dict(item) for item in data]
+
+
+class RunMetrics:
+    """Счетчики и задержки операций за один запуск"""
+    
+    def __init__(self):
+        self.started = time.time()
+        self.apps_discovered: Optional[int] = None
+        self.scan_seconds: Optional[float] = None
+        self.operations: Dict[str, Dict[str, float]] = {}
+        self.errors: Dict[str, int] = {}
+        # Метрики пишутся и из потоков пула (smoke-тест, классификация)
+        self._lock = threading.Lock()
+    
+    def observe(self, operation: str, seconds: float, success: bool = True):
+        with self._lock:
+            stats = self.operations.setdefault(operation, {
+                "count": 0, "success": 0, "failure": 0, "seconds_sum": 0.0, "seconds_max": 0.0
+            })
+            stats["count"] += 1
+            stats["success" if success else "failure"] += 1
+            stats["seconds_sum"] += seconds
+            stats["seconds_max"] = max(stats["seconds_max"], seconds)
+    
+    def error(self, kind: str):
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def timed_operation(name: str):
+    """Декоратор: учет длительности и результата метода AppPatcher в метриках"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            started = time.monotonic()
+            result = method(self, *args, **kwargs)
+            self.metrics.observe(name, time.monotonic() - started, bool(result) or result == {})
+            return result
+        return wrapper
+    return decorator
+
+
+def _prometheus_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(snapshot: Dict) -> str:
+    """Снимок метрик в текстовом формате Prometheus (textfile collector)"""
+    prefix = "appanglepatcher"
+    lines = []
+    
+    def metric(name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{prefix}_{name}{labels} {value}")
+    
+    metric("last_run_timestamp_seconds", "gauge", "Time of the last run",
+           [("", snapshot["timestamp"])])
+    metric("run_duration_seconds", "gauge", "Duration of the last run",
+           [("", snapshot["run_seconds"])])
+    if snapshot["apps_discovered"] is not None:
+        metric("apps_discovered", "gauge", "Target apps found by the last scan",
+               [("", snapshot["apps_discovered"])])
+        metric("scan_duration_seconds", "gauge", "Duration of the last scan",
+               [("", snapshot["scan_duration_seconds"])])
+    metric("patched_apps", "gauge", "Patched apps by patch mode",
+           [(f'{{mode="{_prometheus_label(mode)}"}}', count)
+            for mode, count in sorted(snapshot["patched_apps_by_mode"].items())])
+    metric("backups", "gauge", "Number of backups", [("", snapshot["backups"]["count"])])
+    metric("backup_bytes", "gauge", "Size of recorded backups in bytes", [("", snapshot["backups"]["bytes"])])
+    
+    # Значения относятся только к последнему запуску, поэтому это gauge, а не counter:
+    # иначе Prometheus считал бы каждый запуск сбросом счетчика
+    operations = sorted(snapshot["operations"].items())
+    metric("last_run_operations", "gauge", "Operations in the last run by result",
+           [(f'{{operation="{_prometheus_label(op)}",result="{result}"}}', stats[result])
+            for op, stats in operations for result in ("success", "failure")])
+    metric("last_run_operation_duration_seconds", "gauge", "Total operation latency in the last run",
+           [(f'{{operation="{_prometheus_label(op)}"}}', round(stats["seconds_sum"], 6)) for op, stats in operations])
+    metric("last_run_operation_duration_seconds_max", "gauge", "Maximum operation latency in the last run",
+           [(f'{{operation="{_prometheus_label(op)}"}}', round(stats["seconds_max"], 6)) for op, stats in operations])
+    metric("last_run_errors", "gauge", "Errors in the last run by type",
+           [(f'{{type="{_prometheus_label(kind)}"}}', count) for kind, count in sorted(snapshot["errors"].items())])
+    
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(snapshot: Dict, metrics_file: str, metrics_format: Optional[str] = None):
+    """Атомарная запись снимка метрик (Prometheus textfile или JSON)"""
+    path = Path(os.path.expanduser(metrics_file))
+    if metrics_format is None:
+        metrics_format = "prometheus" if path.suffix == ".prom" else "json"
+    
+    if metrics_format == "prometheus":
+        content = format_prometheus(snapshot)
+    else:
+        content = json.dumps(snapshot, ensure_ascii=False, indent=2) + "\n"
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f".{path.name}.tmp")
+    tmp_file.write_text(content, encoding='utf-8')
+    os.replace(tmp_file, path)
+
+
+# Команды загрузки библиотек Mach-O: LC_LOAD_DYLIB, LC_LOAD_WEAK_DYLIB, LC_REEXPORT_DYLIB,
+# LC_LAZY_LOAD_DYLIB, LC_LOAD_UPWARD_DYLIB
+MACHO_DYLIB_COMMANDS = {0xc, 0x80000018, 0x8000001f, 0x20, 0x80000023}
+
+
+def macho_linked_libraries(path: Path, fs: Optional[FileSystem] = None) -> List[str]:
+    """
+    Список библиотек, подключаемых Mach-O файлом
+    Читается только заголовок и команды загрузки (обычно несколько КБ)
+    """
+    fs = fs or LocalFileSystem()
+    libraries = []
+    head = fs.read_region(path, 0, 4096)
+    if len(head) < 8:
+        return libraries
+    
+    # Универсальный (fat) бинарник: берем первую архитектуру
+    slice_offset = 0
+    fat_magic = struct.unpack('>I', head[:4])[0]
+    if fat_magic in (0xcafebabe, 0xcafebabf):
+        nfat_arch = struct.unpack('>I', head[4:8])[0]
+        # 0xcafebabe также у Java class-файлов - у них это поле большое
+        if not 0 < nfat_arch < 64:
+            return libraries
+        if fat_magic == 0xcafebabe:
+            slice_offset = struct.unpack('>I', head[16:20])[0]
+        else:
+            slice_offset = struct.unpack('>Q', head[16:24])[0]
+        head = fs.read_region(path, slice_offset, 32)
+        if len(head) < 28:
+            return libraries
+    
+    magic_le = struct.unpack('<I', head[:4])[0]
+    if magic_le in (0xfeedface, 0xfeedfacf):
+        endian = '<'
+    elif magic_le in (0xcefaedfe, 0xcffaedfe):
+        endian = '>'
+    else:
+        return libraries
+    header_size = 32 if magic_le in (0xfeedfacf, 0xcffaedfe) else 28
+    ncmds, sizeofcmds = struct.unpack(endian + 'II', head[16:24])
+    
+    commands = fs.read_region(path, slice_offset + header_size, min(sizeofcmds, 1024 * 1024))
+    
+    position = 0
+    for _ in range(ncmds):
+        if position + 8 > len(commands):
+            break
+        cmd, cmdsize = struct.unpack(endian + 'II', commands[position:position + 8])
+        if cmdsize < 8:
+            break
+        if cmd in MACHO_DYLIB_COMMANDS and cmdsize >= 12:
+            name_offset = struct.unpack(endian + 'I', commands[position + 8:position + 12])[0]
+            raw_name = commands[position + name_offset:position + cmdsize].split(b"\0", 1)[0]
+            libraries.append(raw_name.decode('utf-8', 'replace'))
+        position += cmdsize
+    
+    return libraries
+
+
+def fsync_directory(path) -> None:
+    """fsync директории, чтобы переименования в ней пережили сбой"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Не все файловые системы поддерживают fsync директорий
+        pass
+    finally:
+        os.close(fd)
+
+
+class FsyncBatch:
+    """Отложенные fsync директорий: одна синхронизация на директорию за весь пакет"""
+    
+    def __init__(self, fs: FileSystem):
+        self.fs = fs
+        self._dirs: Set[str] = set()
+        self._lock = threading.Lock()
+    
+    def add(self, directory):
+        with self._lock:
+            self._dirs.add(os.path.abspath(directory))
+    
+    def flush(self):
+        with self._lock:
+            dirs = sorted(self._dirs)
+            self._dirs.clear()
+        for directory in dirs:
+            self.fs.fsync_dir(directory)
+
+
+def lower_process_priority() -> bool:
+    """Понижение приоритета процесса и ввода-вывода, если ОС это поддерживает"""
+    lowered = False
+    try:
+        os.nice(10)
+        lowered = True
+    except (AttributeError, OSError):
+        pass
+    
+    if sys.platform == "darwin":
+        # setiopolicy_np(IOPOL_TYPE_DISK, IOPOL_SCOPE_PROCESS, IOPOL_THROTTLE)
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            if libc.setiopolicy_np(0, 0, 3) == 0:
+                lowered = True
+        except (OSError, AttributeError):
+            pass
+    elif sys.platform.startswith("linux") and shutil.which("ionice"):
+        # Класс idle: ввод-вывод только когда диск свободен
+        try:
+            result = subprocess.run(["ionice", "-c", "3", "-p", str(os.getpid())],
+                                    capture_output=True)
+            if result.returncode == 0:
+                lowered = True
+        except OSError:
+            pass
+    
+    return lowered
+
+
 class AppPatcher:
     def __init__(self, language: str = "en"):
         # Основные директории приложений
@@ -23,6 +1091,35 @@ class AppPatcher:
         self.user_applications_dir = Path("~/Applications").expanduser()
         self.backup_dir = Path("~/Applications/App-Backups").expanduser()
         
+        # Файловая система, через которую выполняются все операции с bundles и состоянием
+        self.fs: FileSystem = LocalFileSystem()
+        
+        # Настраиваемые корни поиска (None - стандартные директории выше)
+        self.search_roots: Optional[List[SearchRoot]] = None
+        
+        # Состояние запатченных приложений (отпечатки файлов для аудита)
+        self.state_dir = Path("~/Library/Application Support/AppAnglePatcher").expanduser()
+        self._state: Optional[Dict] = None
+        
+        # Ограничение ввода-вывода для копирования и удаления (None - без ограничений)
+        self.io_throttle: Optional[IOThrottle] = None
+        
+        # Сколько предыдущих поколений резервной копии хранить для каждого приложения
+        self.max_backup_generations = 3
+        
+        # Глубокая проверка Chromium/Electron по фреймворкам и Mach-O (включается --deep-scan)
+        self.deep_scan = False
+        self._classifier_cache: Optional[Dict] = None
+        self._classifier_cache_dirty = False
+        self._classifier_lock = threading.Lock()
+        
+        # Пакетная синхронизация на диск (активна внутри durable_batch)
+        self._fsync_batch: Optional[FsyncBatch] = None
+        self._state_dirty = False
+        
+        # Метрики текущего запуска
+        self.metrics = RunMetrics()
+        
         # Текущий язык
         self.language = language
         
@@ -51,6 +1148,10 @@ class AppPatcher:
             "en": {
                 "backup_created": "✅ Backup created: {}",
                 "backup_failed": "⚠️ Warning: Could not create backup: {}",
+                "backup_reused": "♻️ Backup is up to date, reusing: {}",
+                "backup_kept_patched": "⚠️ Warning: {} is patched but differs from its backup, keeping the existing backup: {}",
+                "backup_generation_kept": "🗂️ Previous backup kept as generation {}",
+                "generation_not_found": "❌ Backup generation {} for {} not found",
                 "app_patched": "✅ App patched: {}",
                 "launch_args": "🚀 Launch arguments: {}",
                 "app_restored": "✅ App restored from backup: {}",
@@ -96,6 +1197,7 @@ class AppPatcher:
                 "searching_apps": "🔍 Searching for target apps...",
                 "found_apps": "📋 Found {} target apps:",
                 "patched_status": " (patched)",
+                "duplicate_app_name": "⚠️ Warning: {} found in several places, using {} (ignoring {})",
                 "interactive_title": "🎯 App Patcher - Interactive Mode",
                 "menu_options": [
                     "1. Find target apps",
@@ -117,11 +1219,26 @@ class AppPatcher:
                     "1. English",
                     "2. Russian"
                 ],
-                "language_prompt": "Enter choice (1-2):"
+                "language_prompt": "Enter choice (1-2):",
+                "audit_title": "🩺 Audit of {} patched apps:",
+                "audit_summary": "📊 ok: {}, overwritten: {}, orphaned: {}, args-mismatch: {}",
+                "smoke_title": "🧪 Smoke-testing {} patched apps:",
+                "smoke_summary": "📊 Passed {}/{} launchers",
+                "snapshot_created": "📸 Generation {} saved: {} patched apps",
+                "snapshot_not_found": "❌ Generation {} not found",
+                "no_snapshots": "ℹ️ No generations found",
+                "rollback_summary": "↩️ Rollback to {}: rewritten {}, unpatched {}, unchanged {}, errors {}",
+                "plan_title": "📝 Planned changes (nothing was written to disk): {}",
+                "plan_empty": "📝 No changes planned",
+                "simulate_summary": "⏱️ Simulated {} apps: {} file operations in {:.2f}s"
             },
             "ru": {
                 "backup_created": "✅ Резервная копия создана: {}",
                 "backup_failed": "⚠️ Предупреждение: Не удалось создать резервную копию: {}",
+                "backup_reused": "♻️ Резервная копия актуальна, используем ее: {}",
+                "backup_kept_patched": "⚠️ Внимание: {} запатчено, но отличается от резервной копии, оставляем прежнюю копию: {}",
+                "backup_generation_kept": "🗂️ Предыдущая резервная копия сохранена как поколение {}",
+                "generation_not_found": "❌ Поколение резервной копии {} для {} не найдено",
                 "app_patched": "✅ Приложение запатчено: {}",
                 "launch_args": "🚀 Аргументы запуска: {}",
                 "app_restored": "✅ Приложение восстановлено из резервной копии: {}",
@@ -167,6 +1284,7 @@ class AppPatcher:
                 "searching_apps": "🔍 Поиск целевых приложений...",
                 "found_apps": "📋 Найдено {} целевых приложений:",
                 "patched_status": " (запатчено)",
+                "duplicate_app_name": "⚠️ Внимание: {} найдено в нескольких местах, используется {} (пропущено {})",
                 "interactive_title": "🎯 App Patcher - Интерактивный режим",
                 "menu_options": [
                     "1. Найти целевые приложения",
@@ -188,7 +1306,18 @@ class AppPatcher:
                     "1. Английский",
                     "2. Русский"
                 ],
-                "language_prompt": "Введите выбор (1-2):"
+                "language_prompt": "Введите выбор (1-2):",
+                "audit_title": "🩺 Аудит {} запатченных приложений:",
+                "audit_summary": "📊 ok: {}, перезаписано: {}, потеряно: {}, аргументы не совпадают: {}",
+                "smoke_title": "🧪 Проверка запуска {} запатченных приложений:",
+                "smoke_summary": "📊 Проверку прошли {}/{} загрузчиков",
+                "snapshot_created": "📸 Поколение {} сохранено: {} запатченных приложений",
+                "snapshot_not_found": "❌ Поколение {} не найдено",
+                "no_snapshots": "ℹ️ Поколения не найдены",
+                "rollback_summary": "↩️ Откат к {}: перезаписано {}, распатчено {}, без изменений {}, ошибок {}",
+                "plan_title": "📝 Запланированные изменения (на диск ничего не записано): {}",
+                "plan_empty": "📝 Изменений не запланировано",
+                "simulate_summary": "⏱️ Смоделировано приложений: {}, файловых операций: {} за {:.2f}с"
             }
         }
     
@@ -202,24 +1331,539 @@ class AppPatcher:
         if language in self.translations:
             self.language = language
     
+    def _throttle(self) -> Optional[IOThrottle]:
+        return self.io_throttle if self.io_throttle and self.io_throttle.enabled else None
+    
+    def _copytree(self, src: Path, dst: Path) -> int:
+        """Копирование дерева с учетом ограничения ввода-вывода, возвращает число байт"""
+        return self.fs.copytree(src, dst, self._throttle())
+    
+    def _rmtree(self, path: Path):
+        """Удаление дерева с учетом ограничения ввода-вывода"""
+        self.fs.rmtree(path, self._throttle())
+    
+    def _parallel_map(self, func, items, max_workers: int) -> List:
+        """map в пуле потоков; последовательно, если файловой системе потоки не помогают"""
+        if not self.fs.concurrent or max_workers <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(func, items))
+    
+    def _read_json(self, path: Path):
+        return json.loads(self.fs.read_bytes(path).decode('utf-8'))
+    
+    def _write_json(self, path: Path, data, sync: bool = False):
+        """Атомарная запись JSON: временный файл и замена"""
+        self.fs.mkdir(path.parent)
+        tmp_file = path.with_name(f".{path.name}.tmp")
+        self.fs.write_bytes(tmp_file, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'), sync=sync)
+        self.fs.rename(tmp_file, path)
+    
+    @property
+    def state_file(self) -> Path:
+        return self.state_dir / "state.json"
+    
+    def _load_state(self) -> Dict:
+        """Загрузка сохраненного состояния (кэшируется на время работы)"""
+        if self._state is None:
+            try:
+                self._state = self._read_json(self.state_file)
+            except (OSError, ValueError):
+                self._state = {}
+            self._state.setdefault("apps", {})
+        return self._state
+    
+    def _save_state(self):
+        """Атомарная запись состояния на диск (в пакетном режиме - один раз в конце)"""
+        if self._state is None:
+            return
+        if self._fsync_batch is not None:
+            self._state_dirty = True
+            return
+        try:
+            self._write_json(self.state_file, self._state, sync=True)
+            self.fs.fsync_dir(self.state_dir)
+        except OSError as e:
+            print(f"   Warning: Could not save state to {self.state_file}: {e}")
+    
+    def _fingerprint(self, path: Path) -> Optional[List[int]]:
+        """Отпечаток файла по stat: inode, размер, время изменения"""
+        try:
+            st = self.fs.stat(path)
+        except OSError:
+            return None
+        return [st.st_ino, st.st_size, st.st_mtime_ns]
+    
+    @staticmethod
+    def _launcher_script(app_name: str, executable_name: str, launch_args: str) -> str:
+        """Содержимое скрипта-загрузчика"""
+        return f'''#!/bin/bash
+
+# Auto-launch script for {app_name}
+ORIGINAL_EXECUTABLE="$(dirname "$0")/{executable_name}.original"
+APP_NAME="{app_name}"
+
+echo "Launching $APP_NAME with arguments: {launch_args}"
+
+# Запускаем оригинальный исполняемый файл с указанными аргументами
+exec "$ORIGINAL_EXECUTABLE" {launch_args} "$@"
+'''
+    
+    def _read_launcher_args(self, launcher: Path) -> Optional[str]:
+        """Аргументы из нашего скрипта-загрузчика или None, если это не он"""
+        try:
+            head = self.fs.read_region(launcher, 0, 4096)
+        except OSError:
+            return None
+        return self._parse_launcher_args(head)
+    
+    @staticmethod
+    def _parse_launcher_args(head: bytes) -> Optional[str]:
+        if not head.startswith(b"#!") or b"# Auto-launch script for" not in head:
+            return None
+        match = re.search(rb'exec "\$ORIGINAL_EXECUTABLE" (.*) "\$@"', head)
+        return match.group(1).decode('utf-8', 'replace') if match else None
+    
+    def _record_patch(self, app_name: str, app_path: Path, executable_name: str,
+                      patch_mode: str, launch_args: str, tree_fingerprint: Optional[str] = None):
+        """
+        Запоминание отпечатков загрузчика и оригинала после патчинга
+        tree_fingerprint - уже посчитанный отпечаток дерева, чтобы не обходить bundle еще раз
+        """
+        macos_dir = app_path / "Contents" / "MacOS"
+        state = self._load_state()
+        state["apps"][app_name] = {
+            "path": os.path.abspath(app_path),
+            "executable": executable_name,
+            "mode": patch_mode,
+            "args": launch_args,
+            "launcher": self._fingerprint(macos_dir / executable_name),
+            "original": self._fingerprint(macos_dir / f"{executable_name}.original"),
+            "patched_at": int(time.time())
+        }
+        
+        # Отпечаток запатченного дерева позволяет переиспользовать копию при повторном запуске
+        backup_record = state.get("backups", {}).get(app_name)
+        if backup_record is not None:
+            backup_record["patched_fingerprint"] = tree_fingerprint or self._tree_fingerprint(app_path)
+        self._save_state()
+    
+    def _forget_patch(self, app_name: str):
+        """Удаление записи о приложении из состояния"""
+        state = self._load_state()
+        if state["apps"].pop(app_name, None) is not None:
+            self._save_state()
+    
+    @contextlib.contextmanager
+    def durable_batch(self):
+        """
+        Пакетный режим синхронизации: данные файлов синхронизируются сразу,
+        а fsync директорий и запись состояния выполняются один раз в конце
+        """
+        if self._fsync_batch is not None:
+            yield
+            return
+        self._fsync_batch = FsyncBatch(self.fs)
+        try:
+            yield
+        finally:
+            batch, self._fsync_batch = self._fsync_batch, None
+            self._flush_batch(batch)
+    
+    @contextlib.contextmanager
+    def suspend_durable_batch(self):
+        """Временный выход из пакетного режима: отложенное записывается, дальше все синхронизируется сразу"""
+        batch = self._fsync_batch
+        if batch is None:
+            yield
+            return
+        self._fsync_batch = None
+        self._flush_batch(batch)
+        try:
+            yield
+        finally:
+            self._fsync_batch = batch
+    
+    def _flush_batch(self, batch: FsyncBatch):
+        batch.flush()
+        if self._state_dirty:
+            self._state_dirty = False
+            self._save_state()
+    
+    def _sync_dir(self, directory: Path):
+        """fsync директории сейчас или в конце пакета"""
+        if self._fsync_batch is not None:
+            self._fsync_batch.add(directory)
+        else:
+            self.fs.fsync_dir(directory)
+    
+    def _install_launcher(self, launcher: Path, content: str):
+        """Атомарная установка загрузчика: временный файл, права, затем замена"""
+        tmp_file = launcher.with_name(f".{launcher.name}.{os.getpid()}.tmp")
+        try:
+            self.fs.write_bytes(tmp_file, content.encode('utf-8'), mode=0o755, sync=True)
+            self.fs.rename(tmp_file, launcher)
+        except BaseException:
+            try:
+                self.fs.unlink(tmp_file)
+            except OSError:
+                pass
+            raise
+        self._sync_dir(launcher.parent)
+    
+    def _link_original(self, executable: Path, original: Path):
+        """
+        Создание .original без удаления исполняемого файла
+        Жесткая ссылка, а если ФС ее не поддерживает - копия через временный файл
+        """
+        try:
+            self.fs.link(executable, original)
+        except OSError:
+            tmp_file = original.with_name(f".{original.name}.{os.getpid()}.tmp")
+            try:
+                self.fs.copy_file(executable, tmp_file)
+                self.fs.rename(tmp_file, original)
+            except BaseException:
+                try:
+                    self.fs.unlink(tmp_file)
+                except OSError:
+                    pass
+                raise
+    
+    def _is_interrupted_patch(self, executable: Path, original: Path) -> bool:
+        """.original совпадает с исполняемым файлом: патчинг прервался до замены загрузчиком"""
+        try:
+            if self.fs.samefile(executable, original):
+                return True
+            if self.fs.stat(executable).st_size != self.fs.stat(original).st_size:
+                return False
+            return self.fs.read_bytes(executable) == self.fs.read_bytes(original)
+        except OSError:
+            return False
+    
+    def _discard_interrupted_patch(self, macos_dir: Path, executable_name: str):
+        """Удаление следов прерванного патчинга: временных файлов и лишнего .original"""
+        for name in self.fs.listdir(macos_dir):
+            if name.startswith(f".{executable_name}") and name.endswith(".tmp"):
+                try:
+                    self.fs.unlink(macos_dir / name)
+                except OSError:
+                    pass
+        executable = macos_dir / executable_name
+        original = macos_dir / f"{executable_name}.original"
+        if self.fs.exists(original) and self.fs.exists(executable) and self._is_interrupted_patch(executable, original):
+            self.fs.unlink(original)
+    
+    @property
+    def snapshots_dir(self) -> Path:
+        return self.state_dir / "generations"
+    
+    def _snapshot_file(self, name: str) -> Path:
+        safe_name = re.sub(r'[^\w.-]', '_', name)
+        return self.snapshots_dir / f"{safe_name}.json"
+    
+    def create_snapshot(self, name: str) -> int:
+        """Сохранение поколения: режим, аргументы и содержимое загрузчика каждого запатченного приложения"""
+        apps = {}
+        for app_name, entry in self._load_state()["apps"].items():
+            launcher = Path(entry["path"]) / "Contents" / "MacOS" / entry["executable"]
+            try:
+                content = self.fs.read_bytes(launcher).decode('utf-8')
+            except (OSError, UnicodeDecodeError):
+                continue
+            apps[app_name] = {
+                "path": entry["path"],
+                "executable": entry["executable"],
+                "mode": entry.get("mode"),
+                "args": entry.get("args", ""),
+                "content": content
+            }
+        
+        self._write_json(self._snapshot_file(name), {"name": name, "created_at": int(time.time()), "apps": apps})
+        return len(apps)
+    
+    def list_snapshots(self) -> List[Dict]:
+        """Сохраненные поколения загрузчиков (от новых к старым)"""
+        snapshots = []
+        if not self.fs.exists(self.snapshots_dir):
+            return snapshots
+        for file_name in self.fs.listdir(self.snapshots_dir):
+            if not file_name.endswith(".json"):
+                continue
+            snapshot_file = self.snapshots_dir / file_name
+            try:
+                data = self._read_json(snapshot_file)
+            except (OSError, ValueError):
+                continue
+            snapshots.append({"name": data.get("name", snapshot_file.stem),
+                              "created_at": data.get("created_at"), "apps": len(data.get("apps", {}))})
+        return sorted(snapshots, key=lambda item: item["created_at"] or 0, reverse=True)
+    
+    def _rollback_app(self, app_name: str, entry: Optional[Dict], current: Optional[Dict]) -> Dict:
+        """Приведение загрузчика одного приложения к состоянию поколения"""
+        source = entry or current
+        macos_dir = Path(source["path"]) / "Contents" / "MacOS"
+        launcher = macos_dir / source["executable"]
+        original = macos_dir / f"{source['executable']}.original"
+        result = {"app": app_name, "action": "unchanged"}
+        
+        try:
+            # Загрузчик заменен свежим бинарником (автообновление): .original устарел, bundle не трогаем
+            if (self.fs.exists(original) and self.fs.exists(launcher)
+                    and self._read_launcher_args(launcher) is None):
+                result["action"] = "error"
+                result["error"] = "overwritten: launcher was replaced, re-patch the app instead"
+                return result
+            
+            if entry is None:
+                # Приложение запатчено после снимка - возвращаем оригинальный исполняемый файл
+                if self.fs.exists(original):
+                    self.fs.rename(original, launcher)
+                    self._sync_dir(macos_dir)
+                    result["action"] = "unpatched"
+                return result
+            
+            if not self.fs.exists(original):
+                if self.fs.exists(launcher) and self._read_launcher_args(launcher) is None:
+                    # Приложение было восстановлено - заново сохраняем бинарник как .original
+                    self._link_original(launcher, original)
+                else:
+                    result["action"] = "error"
+                    result["error"] = "orphaned: .original binary is missing"
+                    return result
+            
+            try:
+                current_content = self.fs.read_bytes(launcher).decode('utf-8')
+            except (OSError, UnicodeDecodeError):
+                current_content = None
+            if current_content != entry["content"]:
+                self._install_launcher(launcher, entry["content"])
+                result["action"] = "rewritten"
+        except OSError as e:
+            result["action"] = "error"
+            result["error"] = str(e)
+        return result
+    
+    def rollback_to_snapshot(self, name: str) -> Optional[List[Dict]]:
+        """Параллельный откат загрузчиков всех приложений к поколению, без копирования bundles"""
+        try:
+            snapshot = self._read_json(self._snapshot_file(name))
+        except (OSError, ValueError):
+            return None
+        
+        snapshot_apps = snapshot.get("apps", {})
+        current_apps = self._load_state()["apps"]
+        names = sorted(set(snapshot_apps) | set(current_apps))
+        
+        backups = self._load_state().get("backups", {})
+        
+        def rollback_one(app_name: str) -> Tuple[Dict, Optional[str]]:
+            result = self._rollback_app(app_name, snapshot_apps.get(app_name), current_apps.get(app_name))
+            # Обход дерева для отпечатка - в потоке пула и только для перезаписанных приложений
+            tree_fingerprint = None
+            if result["action"] == "rewritten" and app_name in backups:
+                tree_fingerprint = self._tree_fingerprint(Path(snapshot_apps[app_name]["path"]))
+            return result, tree_fingerprint
+        
+        outcomes = self._parallel_map(rollback_one, names, min(32, len(names)))
+        
+        # Состояние обновляем в основном потоке после всех замен; неизмененные приложения не трогаем
+        for result, tree_fingerprint in outcomes:
+            app_name = result["app"]
+            if result["action"] == "unpatched":
+                current_apps.pop(app_name, None)
+            elif result["action"] == "rewritten":
+                entry = snapshot_apps[app_name]
+                self._record_patch(app_name, Path(entry["path"]), entry["executable"],
+                                   entry["mode"], entry["args"], tree_fingerprint)
+        self._save_state()
+        return [result for result, _ in outcomes]
+    
+    def audit_app(self, app_name: str, entry: Dict) -> Dict:
+        """
+        Проверка одного запатченного приложения по сохраненным отпечаткам
+        Статусы: ok, overwritten, orphaned, args-mismatch
+        """
+        macos_dir = Path(entry["path"]) / "Contents" / "MacOS"
+        launcher = macos_dir / entry["executable"]
+        original = macos_dir / f"{entry['executable']}.original"
+        
+        launcher_fp = self._fingerprint(launcher)
+        original_fp = self._fingerprint(original)
+        result = {"app": app_name, "path": entry["path"], "mode": entry.get("mode"), "status": "ok"}
+        
+        expected_args = entry.get("args", "")
+        if entry.get("mode") in self.patch_modes and entry.get("mode") != "custom":
+            expected_args = self.patch_modes[entry["mode"]]
+        
+        if original_fp is None:
+            # Загрузчик ссылается на несуществующий бинарник
+            result["status"] = "orphaned"
+        elif launcher_fp is None:
+            result["status"] = "orphaned"
+        elif launcher_fp == entry.get("launcher") and original_fp == entry.get("original"):
+            # Быстрый путь: файлы не менялись с момента патчинга
+            if entry.get("args", "") != expected_args:
+                result["status"] = "args-mismatch"
+        else:
+            # Отпечаток изменился - читаем заголовок загрузчика
+            actual_args = self._read_launcher_args(launcher)
+            if actual_args is None or original_fp != entry.get("original"):
+                # Обновление положило новый исполняемый файл рядом со старым .original
+                result["status"] = "overwritten"
+            elif actual_args != expected_args:
+                result["status"] = "args-mismatch"
+                result["actual_args"] = actual_args
+        
+        result["expected_args"] = expected_args
+        return result
+    
+    def audit_patched_apps(self) -> List[Dict]:
+        """Параллельный аудит всех известных запатченных приложений"""
+        entries = self._load_state()["apps"]
+        if not entries:
+            return []
+        return self._parallel_map(lambda item: self.audit_app(*item), sorted(entries.items()), min(32, len(entries)))
+    
+    def get_search_roots(self) -> List[SearchRoot]:
+        """Корни поиска с раскрытыми шаблонами путей"""
+        roots = self.search_roots
+        if roots is None:
+            roots = [SearchRoot(self.applications_dir), SearchRoot(self.user_applications_dir)]
+        
+        # Резервные копии лежат внутри ~/Applications и не должны находиться как приложения
+        backup_pattern = glob.escape(str(self.backup_dir))
+        backup_patterns = [backup_pattern, os.path.join(backup_pattern, "*")]
+        expanded = []
+        for root in roots:
+            for match in root.expand(self.fs):
+                match.exclude.extend(pattern for pattern in backup_patterns if pattern not in match.exclude)
+                expanded.append(match)
+        return expanded
+    
+    # Заглушка вместо настоящего бинарника: записывает argv и сразу завершается
+    SMOKE_STUB = '#!/bin/sh\nprintf \'%s\\000\' "$@" > "$APPANGLE_SMOKE_ARGV"\n'
+    SMOKE_SENTINEL = "--appangle-smoke-test"
+    
+    def smoke_test_app(self, app_name: str, entry: Dict, timeout: float = 5.0) -> Dict:
+        """
+        Запуск копии загрузчика с заглушкой вместо .original
+        Проверяет, что загрузчик передает аргументы режима и пользовательские аргументы
+        """
+        started = time.monotonic()
+        launcher = Path(entry["path"]) / "Contents" / "MacOS" / entry["executable"]
+        expected_args = entry.get("args", "")
+        if entry.get("mode") in self.patch_modes and entry.get("mode") != "custom":
+            expected_args = self.patch_modes[entry["mode"]]
+        expected_argv = shlex.split(expected_args) + [self.SMOKE_SENTINEL]
+        result = {"app": app_name, "path": entry["path"], "mode": entry.get("mode"),
+                  "status": "pass", "expected_argv": expected_argv}
+        
+        try:
+            launcher_data = self.fs.read_bytes(launcher)
+        except OSError as e:
+            launcher_data = None
+            result["status"] = "error"
+            result["error"] = str(e)
+        
+        if launcher_data is not None:
+            if self._parse_launcher_args(launcher_data[:4096]) is None:
+                # После автообновления на месте загрузчика настоящий бинарник: его не копируем и не запускаем
+                result["status"] = "overwritten"
+                result["error"] = "launcher is not our script, nothing was run"
+            else:
+                self._run_smoke_launcher(entry["executable"], launcher_data, expected_argv, timeout, result)
+        
+        elapsed = time.monotonic() - started
+        result["seconds"] = round(elapsed, 6)
+        self.metrics.observe("smoke_test", elapsed, result["status"] == "pass")
+        if result["status"] != "pass":
+            self.metrics.error(f"smoke_test:{result['status']}")
+        return result
+    
+    def _run_smoke_launcher(self, executable: str, launcher_data: bytes, expected_argv: List[str],
+                            timeout: float, result: Dict):
+        try:
+            with tempfile.TemporaryDirectory(prefix="appangle-smoke-") as tmp_dir:
+                # Копия загрузчика рядом с заглушкой: сам bundle не запускается и не меняется
+                test_launcher = Path(tmp_dir) / executable
+                test_launcher.write_bytes(launcher_data)
+                test_launcher.chmod(0o755)
+                stub = Path(tmp_dir) / f"{executable}.original"
+                stub.write_text(self.SMOKE_STUB)
+                stub.chmod(0o755)
+                argv_file = Path(tmp_dir) / "argv"
+                
+                env = dict(os.environ, APPANGLE_SMOKE_ARGV=str(argv_file))
+                subprocess.run([str(test_launcher), self.SMOKE_SENTINEL], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               timeout=timeout, check=False)
+                
+                if not argv_file.exists():
+                    result["status"] = "fail"
+                    result["error"] = "launcher did not exec the .original binary"
+                else:
+                    raw = argv_file.read_bytes()
+                    actual_argv = [arg.decode('utf-8', 'replace') for arg in raw.split(b"\0")[:-1]]
+                    result["actual_argv"] = actual_argv
+                    if actual_argv != expected_argv:
+                        result["status"] = "fail"
+        except subprocess.TimeoutExpired:
+            result["status"] = "timeout"
+        except OSError as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+    
+    def smoke_test_patched_apps(self, timeout: float = 5.0, workers: int = 16) -> List[Dict]:
+        """Параллельная проверка всех известных запатченных приложений"""
+        entries = self._load_state()["apps"]
+        if not entries:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(entries)))) as pool:
+            return list(pool.map(lambda item: self.smoke_test_app(item[0], item[1], timeout),
+                                 sorted(entries.items())))
+    
+    @timed_operation("scan")
     def find_target_applications(self) -> Dict[str, Path]:
         """Поиск всех целевых приложений в системных директориях"""
+        started = time.monotonic()
         target_apps = {}
         
         # Директории для поиска приложений
-        search_dirs = [self.applications_dir, self.user_applications_dir]
+        search_roots = [root for root in self.get_search_roots() if self.fs.exists(root.path)]
+        if not search_roots:
+            self.metrics.apps_discovered = 0
+            self.metrics.scan_seconds = time.monotonic() - started
+            return target_apps
+        
+        # Независимые корни обходим параллельно
+        per_root = self._parallel_map(lambda root: root.walk_bundles(self.fs), search_roots, min(8, len(search_roots)))
+        
+        # Один и тот же bundle, найденный разными путями, проверяем один раз
+        candidates = []
+        seen = set()
+        for bundles in per_root:
+            for app_path in bundles:
+                real = self.fs.realpath(app_path)
+                if real not in seen:
+                    seen.add(real)
+                    candidates.append(app_path)
+        
+        flags = self._parallel_map(lambda path: self._is_target_app(path.stem, path), candidates,
+                                   min(16, len(candidates)))
         
-        for search_dir in search_dirs:
-            if not search_dir.exists():
+        for app_path, is_target in zip(candidates, flags):
+            if not is_target:
                 continue
-            
-            # Рекурсивный поиск .app bundles
-            for app_path in search_dir.rglob("*.app"):
-                app_name = app_path.stem
-                
-                if self._is_target_app(app_name, app_path):
-                    target_apps[app_name] = app_path
+            # Приложения с одинаковым именем в разных корнях: оставляем найденное первым
+            if app_path.stem in target_apps:
+                print(self.t("duplicate_app_name", app_path.stem, target_apps[app_path.stem], app_path))
+                continue
+            target_apps[app_path.stem] = app_path
         
+        self._save_classifier_cache()
+        self.metrics.apps_discovered = len(target_apps)
+        self.metrics.scan_seconds = time.monotonic() - started
         return target_apps
     
     def _is_target_app(self, app_name: str, app_path: Path) -> bool:
@@ -236,9 +1880,8 @@ class AppPatcher:
         # Проверка на Chromium/Electron приложения через Info.plist
         try:
             info_plist = app_path / "Contents" / "Info.plist"
-            if info_plist.exists():
-                with open(info_plist, 'rb') as f:
-                    plist_data = plistlib.load(f)
+            if self.fs.exists(info_plist):
+                plist_data = self.fs.read_plist(info_plist)
                 
                 bundle_id = plist_data.get('CFBundleIdentifier', '')
                 executable = plist_data.get('CFBundleExecutable', '')
@@ -249,11 +1892,73 @@ class AppPatcher:
                 
                 if any(x in executable.lower() for x in ['chromium', 'chrome', 'electron']):
                     return True
+                
+                # Глубокая проверка для приложений, которые не распознаются по имени
+                if self.deep_scan and executable and self._has_chromium_signature(app_path, executable):
+                    return True
         except Exception as e:
             print(f"   Warning: Could not read Info.plist for {app_name}: {e}")
         
         return False
     
+    # Фреймворки, по которым распознаются Electron и CEF приложения
+    CHROMIUM_FRAMEWORKS = ("Electron Framework", "Chromium Embedded Framework")
+    
+    @property
+    def classifier_cache_file(self) -> Path:
+        return self.state_dir / "classifier_cache.json"
+    
+    def _has_chromium_signature(self, app_path: Path, executable: str) -> bool:
+        """
+        Поиск встроенного Electron/CEF фреймворка в bundle и в командах загрузки Mach-O
+        Результат кэшируется по inode и mtime исполняемого файла
+        """
+        macos_dir = app_path / "Contents" / "MacOS"
+        binary = macos_dir / f"{executable}.original"
+        if not self.fs.exists(binary):
+            binary = macos_dir / executable
+        try:
+            st = self.fs.stat(binary)
+        except OSError:
+            return False
+        
+        key = self.fs.realpath(binary)
+        with self._classifier_lock:
+            if self._classifier_cache is None:
+                try:
+                    self._classifier_cache = self._read_json(self.classifier_cache_file)
+                except (OSError, ValueError):
+                    self._classifier_cache = {}
+            cached = self._classifier_cache.get(key)
+        if cached and cached[0] == st.st_ino and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        
+        # Сначала дешевая проверка содержимого Contents/Frameworks
+        frameworks_dir = app_path / "Contents" / "Frameworks"
+        result = any(self.fs.exists(frameworks_dir / f"{name}.framework") for name in self.CHROMIUM_FRAMEWORKS)
+        
+        if not result:
+            try:
+                libraries = macho_linked_libraries(binary, self.fs)
+            except (OSError, ValueError, struct.error):
+                libraries = []
+            result = any(name in library for library in libraries for name in self.CHROMIUM_FRAMEWORKS)
+        
+        with self._classifier_lock:
+            self._classifier_cache[key] = [st.st_ino, st.st_mtime_ns, result]
+            self._classifier_cache_dirty = True
+        return result
+    
+    def _save_classifier_cache(self):
+        """Сохранение кэша глубокой проверки, если он изменился"""
+        if not self._classifier_cache_dirty:
+            return
+        try:
+            self._write_json(self.classifier_cache_file, self._classifier_cache)
+            self._classifier_cache_dirty = False
+        except OSError as e:
+            print(f"   Warning: Could not save classifier cache: {e}")
+    
     def _is_xcode_related(self, app_name: str, app_path: Path) -> bool:
         """Проверка, относится ли приложение к Xcode"""
         xcode_indicators = ['xcode', 'simulator', 'instruments']
@@ -271,9 +1976,8 @@ class AppPatcher:
         # Проверка через Info.plist
         try:
             info_plist = app_path / "Contents" / "Info.plist"
-            if info_plist.exists():
-                with open(info_plist, 'rb') as f:
-                    plist_data = plistlib.load(f)
+            if self.fs.exists(info_plist):
+                plist_data = self.fs.read_plist(info_plist)
                 
                 bundle_id = plist_data.get('CFBundleIdentifier', '')
                 if 'com.apple.dt' in bundle_id or 'xcode' in bundle_id.lower():
@@ -283,76 +1987,184 @@ class AppPatcher:
         
         return False
     
+    def _tree_fingerprint(self, app_path: Path) -> str:
+        """Дешевый отпечаток дерева: пути, размеры и время изменения файлов (без чтения)"""
+        digest = hashlib.sha1()
+        for root, dirs, files in self.fs.walk(app_path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                try:
+                    st = self.fs.stat(full, follow_symlinks=False)
+                except OSError:
+                    continue
+                rel = os.path.relpath(full, app_path)
+                digest.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8', 'surrogateescape'))
+        return digest.hexdigest()
+    
+    def _bundle_version(self, app_path: Path) -> Dict[str, str]:
+        """CFBundleVersion и CFBundleShortVersionString приложения"""
+        try:
+            plist_data = self.fs.read_plist(app_path / "Contents" / "Info.plist")
+        except Exception:
+            return {"version": "", "short_version": ""}
+        return {
+            "version": str(plist_data.get('CFBundleVersion', '')),
+            "short_version": str(plist_data.get('CFBundleShortVersionString', ''))
+        }
+    
+    def _generations_dir(self, app_name: str) -> Path:
+        return self.backup_dir / ".generations" / app_name
+    
+    def list_backup_generations(self, app_name: str) -> List[Dict]:
+        """Предыдущие поколения резервной копии приложения (от новых к старым)"""
+        record = self._load_state().get("backups", {}).get(app_name, {})
+        return list(reversed(record.get("generations", [])))
+    
+    def _archive_backup(self, app_name: str, backup_path: Path, record: Dict) -> List[Dict]:
+        """Перенос текущей резервной копии в поколения (переименование, без копирования)"""
+        version = record.get("short_version") or record.get("version") or "unknown"
+        fingerprint = record.get("fingerprint") or "legacy"
+        generation_id = re.sub(r'[^\w.-]', '_', f"{version}-{fingerprint[:8]}")
+        
+        generations_dir = self._generations_dir(app_name)
+        self.fs.mkdir(generations_dir)
+        target = generations_dir / f"{generation_id}.app"
+        if self.fs.exists(target):
+            self._rmtree(target)
+        self.fs.rename(backup_path, target)
+        
+        generations = [item for item in record.get("generations", []) if item["id"] != generation_id]
+        generations.append({
+            "id": generation_id,
+            "version": record.get("version", ""),
+            "short_version": record.get("short_version", ""),
+            "fingerprint": record.get("fingerprint"),
+            "bytes": record.get("bytes", 0),
+            "created_at": record.get("created_at")
+        })
+        
+        # Ограничиваем число хранимых поколений
+        while len(generations) > self.max_backup_generations:
+            oldest = generations.pop(0)
+            oldest_path = generations_dir / f"{oldest['id']}.app"
+            if self.fs.exists(oldest_path):
+                self._rmtree(oldest_path)
+        
+        print(self.t("backup_generation_kept", generation_id))
+        return generations
+    
+    @timed_operation("backup")
     def backup_app(self, app_name: str, app_path: Path) -> bool:
-        """Создание резервной копии приложения перед патчингом"""
+        """
+        Создание резервной копии приложения перед патчингом
+        Неизменившееся приложение переиспользует копию, новая версия создает новое поколение
+        """
         try:
-            self.backup_dir.mkdir(parents=True, exist_ok=True)
+            self.fs.mkdir(self.backup_dir)
             backup_path = self.backup_dir / f"{app_name}.app"
+            backups = self._load_state().setdefault("backups", {})
+            record = backups.get(app_name)
             
-            # Удаляем старый backup если существует
-            if backup_path.exists():
-                shutil.rmtree(backup_path)
+            version = self._bundle_version(app_path)
+            fingerprint = self._tree_fingerprint(app_path)
+            generations = []
+            
+            if self.fs.exists(backup_path):
+                if record and record.get("version") == version["version"] \
+                        and record.get("short_version") == version["short_version"] \
+                        and fingerprint in (record.get("fingerprint"), record.get("patched_fingerprint")):
+                    # Приложение не менялось с момента копирования (или нашего патча)
+                    print(self.t("backup_reused", backup_path))
+                    return True
+                
+                # Запатченное дерево (наш загрузчик или свежий бинарник рядом с устаревшим .original)
+                # не годится в резервные копии: проверенную копию не вытесняем
+                if self.is_already_patched(app_path):
+                    print(self.t("backup_kept_patched", app_name, backup_path))
+                    return True
+                
+                # Старую копию не удаляем: она становится предыдущим поколением
+                generations = self._archive_backup(app_name, backup_path, record or {})
             
             # Копируем приложение в backup директориу
-            shutil.copytree(app_path, backup_path)
+            copied_bytes = self._copytree(app_path, backup_path)
             print(self.t("backup_created", backup_path))
+            
+            # Размер запоминаем, чтобы метрики не требовали обхода резервных копий
+            backups[app_name] = {
+                "bytes": copied_bytes,
+                "created_at": int(time.time()),
+                "version": version["version"],
+                "short_version": version["short_version"],
+                "fingerprint": fingerprint,
+                "generations": generations
+            }
+            self._save_state()
             return True
         except Exception as e:
             print(self.t("backup_failed", e))
+            self.metrics.error(f"backup:{type(e).__name__}")
             return False
     
     def is_already_patched(self, app_path: Path) -> bool:
         """Проверка, было ли приложение уже запатчено"""
         try:
             macos_dir = app_path / "Contents" / "MacOS"
-            if not macos_dir.exists():
+            if not self.fs.exists(macos_dir):
                 return False
             
             # Ищем оригинальный исполняемый файл
-            for item in macos_dir.iterdir():
-                if item.name.endswith('.original'):
+            for name in self.fs.listdir(macos_dir):
+                if name.endswith('.original'):
+                    # .original, совпадающий с исполняемым файлом, остался от прерванного патчинга
+                    item = macos_dir / name
+                    executable = macos_dir / name[:-len('.original')]
+                    if self.fs.exists(executable) and self._is_interrupted_patch(executable, item):
+                        continue
                     return True
             
             return False
         except:
             return False
     
+    @timed_operation("patch")
     def patch_app(self, app_name: str, app_path: Path, patch_mode: str = "gl", custom_args: str = "") -> bool:
         """Патчинг .app bundle для запуска с указанными аргументами"""
         try:
             # Проверяем, не запатчено ли уже приложение
             if self.is_already_patched(app_path):
                 print(self.t("already_patched", app_name))
+                self._adopt_patched(app_name, app_path)
                 return True
             
             # Получаем информацию о приложении
             info_plist = app_path / "Contents" / "Info.plist"
-            if not info_plist.exists():
+            if not self.fs.exists(info_plist):
                 print(self.t("plist_not_found", app_path))
+                self.metrics.error("patch:plist_not_found")
                 return False
             
-            with open(info_plist, 'rb') as f:
-                plist_data = plistlib.load(f)
+            plist_data = self.fs.read_plist(info_plist)
             
             executable_name = plist_data.get('CFBundleExecutable', '')
             if not executable_name:
                 print(self.t("executable_not_found"))
+                self.metrics.error("patch:executable_not_found")
                 return False
             
             # Путь к оригинальному исполняемому файлу
             macos_dir = app_path / "Contents" / "MacOS"
             original_executable = macos_dir / executable_name
             
-            if not original_executable.exists():
+            if not self.fs.exists(original_executable):
                 print(self.t("executable_missing", executable_name))
+                self.metrics.error("patch:executable_missing")
                 return False
             
-            # Переименовываем оригинальный исполняемый файл
+            # Убираем следы прерванного патчинга
             original_backup = macos_dir / f"{executable_name}.original"
-            if original_backup.exists():
-                original_backup.unlink()
-            
-            original_executable.rename(original_backup)
+            self._discard_interrupted_patch(macos_dir, executable_name)
             
             # Формируем аргументы запуска
             launch_args = self.patch_modes.get(patch_mode, "--use-angle=gl")
@@ -362,80 +2174,128 @@ class AppPatcher:
             # Создаем новый скрипт-загрузчик
             new_executable = macos_dir / executable_name
             
-            script_content = f'''#!/bin/bash
-
-# Auto-launch script for {app_name}
-ORIGINAL_EXECUTABLE="$(dirname "$0")/{executable_name}.original"
-APP_NAME="{app_name}"
-
-echo "Launching $APP_NAME with arguments: {launch_args}"
-
-# Запускаем оригинальный исполняемый файл с указанными аргументами
-exec "$ORIGINAL_EXECUTABLE" {launch_args} "$@"
-'''
+            script_content = self._launcher_script(app_name, executable_name, launch_args)
             
-            new_executable.write_text(script_content)
-            new_executable.chmod(0o755)  # Делаем исполняемым
+            # Оригинал сохраняется под вторым именем, исполняемый файл при этом не исчезает,
+            # затем загрузчик атомарно заменяет его: bundle всегда либо оригинальный, либо запатченный
+            self._link_original(original_executable, original_backup)
+            self._install_launcher(new_executable, script_content)
             
             print(self.t("app_patched", new_executable))
             print(self.t("launch_args", launch_args))
             
+            self._record_patch(app_name, app_path, executable_name, patch_mode, launch_args)
+            
             return True
             
         except Exception as e:
             print(self.t("patching_error", app_name, e))
+            self.metrics.error(f"patch:{type(e).__name__}")
             # Пытаемся восстановить оригинал в случае ошибки
             try:
-                if 'original_backup' in locals() and original_backup.exists():
-                    if new_executable.exists():
-                        new_executable.unlink()
-                    original_backup.rename(original_executable)
+                if 'original_backup' in locals() and self.fs.exists(original_backup):
+                    if self._is_interrupted_patch(original_executable, original_backup):
+                        self.fs.unlink(original_backup)
+                    else:
+                        self.fs.rename(original_backup, original_executable)
             except:
                 pass
             return False
     
-    def restore_app(self, app_name: str, app_path: Path) -> bool:
-        """Восстановление оригинального приложения из резервной копии"""
+    def _adopt_patched(self, app_name: str, app_path: Path):
+        """Запись отпечатков для приложения, запатченного до появления аудита"""
+        if app_name in self._load_state()["apps"]:
+            return
+        try:
+            executable_name = self.fs.read_plist(app_path / "Contents" / "Info.plist").get('CFBundleExecutable', '')
+        except Exception:
+            return
+        launch_args = self._read_launcher_args(app_path / "Contents" / "MacOS" / executable_name)
+        if not executable_name or launch_args is None:
+            return
+        patch_mode = next((mode for mode, args in self.patch_modes.items() if args == launch_args), "custom")
+        self._record_patch(app_name, app_path, executable_name, patch_mode, launch_args)
+    
+    @timed_operation("restore")
+    def restore_app(self, app_name: str, app_path: Path, generation: Optional[str] = None) -> bool:
+        """Восстановление оригинального приложения из резервной копии (или ее поколения)"""
         try:
             backup_path = self.backup_dir / f"{app_name}.app"
+            if generation:
+                backup_path = self._generations_dir(app_name) / f"{generation}.app"
+                if not self.fs.exists(backup_path):
+                    print(self.t("generation_not_found", generation, app_name))
+                    self.metrics.error("restore:generation_not_found")
+                    return False
             
-            if not backup_path.exists():
+            if not self.fs.exists(backup_path):
                 print(self.t("backup_not_found", app_name))
+                self.metrics.error("restore:backup_not_found")
                 return False
             
             # Удаляем патченное приложение
-            if app_path.exists():
-                shutil.rmtree(app_path)
+            if self.fs.exists(app_path):
+                self._rmtree(app_path)
             
             # Восстанавливаем из backup
-            shutil.copytree(backup_path, app_path)
+            self._copytree(backup_path, app_path)
             print(self.t("app_restored", backup_path))
+            self._forget_patch(app_name)
             
             return True
             
         except Exception as e:
             print(self.t("restore_error", app_name, e))
+            self.metrics.error(f"restore:{type(e).__name__}")
             return False
     
     def list_patched_apps(self) -> List[str]:
         """Получение списка запатченных приложений (имеющих резервные копии)"""
         patched_apps = []
         
-        if not self.backup_dir.exists():
+        if not self.fs.exists(self.backup_dir):
             return patched_apps
         
-        for backup in self.backup_dir.glob("*.app"):
-            patched_apps.append(backup.stem)
+        for name in self.fs.listdir(self.backup_dir):
+            if name.endswith(".app"):
+                patched_apps.append(name[:-len(".app")])
         
         return patched_apps
     
     def cleanup_backups(self):
         """Удаление всех резервных копий"""
-        if self.backup_dir.exists():
-            shutil.rmtree(self.backup_dir)
+        if self.fs.exists(self.backup_dir):
+            self._rmtree(self.backup_dir)
+            if self._load_state().pop("backups", None) is not None:
+                self._save_state()
             print(self.t("backups_cleaned"))
         else:
             print(self.t("no_backups"))
+    
+    def metrics_snapshot(self) -> Dict:
+        """Снимок метрик из уже собранных данных, без дополнительного сканирования"""
+        state = self._load_state()
+        
+        patched_by_mode: Dict[str, int] = {}
+        for entry in state["apps"].values():
+            mode = entry.get("mode", "unknown")
+            patched_by_mode[mode] = patched_by_mode.get(mode, 0) + 1
+        
+        recorded_backups = state.get("backups", {})
+        return {
+            "timestamp": int(time.time()),
+            "run_seconds": round(time.time() - self.metrics.started, 6),
+            "apps_discovered": self.metrics.apps_discovered,
+            "scan_duration_seconds": None if self.metrics.scan_seconds is None else round(self.metrics.scan_seconds, 6),
+            "patched_apps_by_mode": patched_by_mode,
+            "backups": {
+                "count": len(self.list_patched_apps()),
+                "bytes": sum(item.get("bytes", 0) + sum(gen.get("bytes", 0) for gen in item.get("generations", []))
+                             for item in recorded_backups.values())
+            },
+            "operations": self.metrics.operations,
+            "errors": self.metrics.errors
+        }
 
 
 def parse_selection(input_str: str, max_number: int) -> Set[int]:
@@ -482,6 +2342,130 @@ def parse_selection(input_str: str, max_number: int) -> Set[int]:
     return selected_numbers
 
 
+def read_batch_specs(values: List[str]) -> List[str]:
+    """
+    Сбор описаний приложений для пакетного режима
+    Значение '-' читает stdin, '@файл' читает файл (по строке на приложение, # - комментарий)
+    """
+    specs = []
+    for value in values:
+        if value == '-':
+            lines = sys.stdin.read().splitlines()
+        elif value.startswith('@'):
+            with open(os.path.expanduser(value[1:]), 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        else:
+            lines = [value]
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                specs.append(line)
+    return specs
+
+
+def parse_batch_spec(spec: str, patch_modes: Dict[str, str], default_mode: str,
+                     default_args: str) -> Tuple[str, str, str]:
+    """
+    Разбор описания приложения: 'Name', 'Name:mode' или 'Name:custom:аргументы'
+    Возвращает (имя, режим, пользовательские аргументы)
+    """
+    parts = spec.split(':', 2)
+    if len(parts) >= 2 and parts[1].strip() in patch_modes:
+        mode = parts[1].strip()
+        custom_args = (parts[2].strip() if mode == "custom" and len(parts) == 3 else "") or default_args
+        return parts[0].strip(), mode, custom_args or ""
+    return spec, default_mode, default_args or ""
+
+
+def resolve_batch(apps: Dict[str, Path], specs: List[Tuple[str, str, str]],
+                  on_ambiguous: str) -> Tuple[List[Tuple[str, Path, str, str]], List[str]]:
+    """
+    Сопоставление описаний с найденными приложениями по одному сканированию
+    Неоднозначность: 'all' - все совпадения, 'first' - первое по имени, 'fail' - ошибка
+    """
+    resolved = []
+    errors = []
+    seen = set()
+    
+    for query, mode, custom_args in specs:
+        # Пустые аргументы в режиме custom превратили бы имя режима в аргумент запуска
+        if mode == "custom" and not custom_args.strip():
+            errors.append(f"Application '{query}': custom mode needs arguments ('{query}:custom:ARGS' or --args)")
+            continue
+        
+        # Точное совпадение имени важнее совпадения по подстроке
+        matches = sorted(name for name in apps if name.lower() == query.lower())
+        if not matches:
+            matches = sorted(name for name in apps if query.lower() in name.lower())
+        
+        if not matches:
+            errors.append(f"Application '{query}' not found")
+            continue
+        if len(matches) > 1:
+            if on_ambiguous == "fail":
+                errors.append(f"Application '{query}' is ambiguous: {', '.join(matches)}")
+                continue
+            if on_ambiguous == "first":
+                matches = matches[:1]
+        
+        for name in matches:
+            if name not in seen:
+                seen.add(name)
+                resolved.append((name, apps[name], mode, custom_args))
+    
+    return resolved, errors
+
+
+def run_batch(patcher: AppPatcher, args: argparse.Namespace) -> List[Dict]:
+    """
+    Пакетный патчинг или восстановление приложений из --apps
+    Ошибки чтения списка и сопоставления возвращаются как неуспешные записи с полем error
+    """
+    try:
+        raw_specs = read_batch_specs(args.apps)
+    except OSError as e:
+        print(f"❌ Could not read application list: {e}")
+        return [{"action": "resolve", "success": False, "error": f"Could not read application list: {e}"}]
+    specs = [parse_batch_spec(spec, patcher.patch_modes, args.mode, args.args) for spec in raw_specs]
+    
+    # Весь пакет разрешается по одному сканированию
+    print(patcher.t("searching_apps"))
+    apps = patcher.find_target_applications()
+    resolved, errors = resolve_batch(apps, specs, args.on_ambiguous)
+    
+    if errors:
+        for error in errors:
+            print(f"❌ {error}")
+        return [{"action": "resolve", "success": False, "error": error} for error in errors]
+    
+    results = []
+    if args.batch_action == "restore":
+        print(patcher.t("restoring_apps", len(resolved)))
+        for name, path, mode, custom_args in resolved:
+            print(patcher.t("restoring_app", name))
+            success = patcher.restore_app(name, path, args.generation)
+            result = {"app": name, "action": "restore", "success": success}
+            if args.generation:
+                result["generation"] = args.generation
+            results.append(result)
+        print(patcher.t("done_restoring", sum(r["success"] for r in results), len(resolved)))
+    else:
+        print(patcher.t("patching_apps", len(resolved)))
+        for name, path, mode, custom_args in resolved:
+            print(patcher.t("patching_app", name))
+            
+            # Создаем backup если не указано обратное
+            if not args.no_backup:
+                patcher.backup_app(name, path)
+            
+            success = patcher.patch_app(name, path, mode, custom_args)
+            print(patcher.t("patching_success") if success else patcher.t("patching_failed"))
+            results.append({"app": name, "action": "patch", "mode": mode, "success": success})
+        print(patcher.t("done_patching", sum(r["success"] for r in results), len(resolved)))
+    
+    return results
+
+
 def select_apps_from_list(patcher: AppPatcher, apps_list: List[Tuple[str, Path]], action: str) -> List[Tuple[str, Path]]:
     """
     Выбор приложений из списка с возможностью множественного выбора
@@ -762,20 +2746,154 @@ def main():
     parser.add_argument('--patch', action='store_true', help='Patch all target applications')
     parser.add_argument('--app', type=str, help='Patch specific application')
     parser.add_argument('--restore', type=str, help='Restore specific application')
+    parser.add_argument('--apps', nargs='+', metavar='SPEC',
+                       help="Patch (or restore) many applications in one run: names, 'Name:mode', "
+                            "'Name:custom:ARGS', '@file' or '-' for stdin")
+    parser.add_argument('--batch-action', type=str, choices=['patch', 'restore'], default='patch',
+                       help='Action for --apps (default: patch)')
+    parser.add_argument('--on-ambiguous', type=str, choices=['all', 'first', 'fail'], default='fail',
+                       help='What to do when an --apps name matches several applications (default: fail)')
+    parser.add_argument('--generation', type=str, help='Backup generation to use with --restore or --apps --batch-action restore')
     parser.add_argument('--restore-all', action='store_true', help='Restore all applications')
     parser.add_argument('--patched', action='store_true', help='Show patched applications')
     parser.add_argument('--cleanup', action='store_true', help='Remove backups')
+    parser.add_argument('--audit', action='store_true', help='Check patched applications for drift')
+    parser.add_argument('--smoke-test', action='store_true',
+                       help='Run patched launchers against a stub binary and check their arguments')
+    parser.add_argument('--smoke-timeout', type=float, default=5.0, help='Timeout per launcher in seconds')
+    parser.add_argument('--snapshot', type=str, metavar='NAME',
+                       help='Save launcher state of all patched apps as a named generation')
+    parser.add_argument('--snapshots', action='store_true', help='Show saved generations')
+    parser.add_argument('--rollback', type=str, metavar='NAME',
+                       help='Rewrite launchers that differ from a saved generation')
+    parser.add_argument('--json', action='store_true', help='Machine-readable JSON output where supported')
     parser.add_argument('--mode', type=str, choices=['gl', 'metal', 'vulkan', 'disable-gpu', 'custom'], 
                        default='gl', help='Patch mode (default: gl)')
     parser.add_argument('--args', type=str, help='Custom arguments for custom mode')
     parser.add_argument('--no-backup', action='store_true', help='Do not create backups')
     parser.add_argument('--lang', type=str, choices=['en', 'ru'], default='en', help='Interface language')
+    parser.add_argument('--throttle-mbps', type=float, default=0,
+                       help='Bandwidth cap for backup/restore/delete in MB/s')
+    parser.add_argument('--throttle-iops', type=float, default=0,
+                       help='File operations per second cap for backup/restore/delete')
+    parser.add_argument('--adaptive-throttle', action='store_true',
+                       help='Back off backup/restore/delete I/O when disk contention is detected')
+    parser.add_argument('--low-priority', action='store_true',
+                       help='Run with lower CPU and I/O priority')
+    parser.add_argument('--roots-config', type=str,
+                       help='JSON file with search roots (path, max_depth, exclude, follow_symlinks)')
+    parser.add_argument('--root', action='append', default=[],
+                       help='Search root (repeatable, glob patterns allowed); replaces the default roots')
+    parser.add_argument('--exclude', action='append', default=[],
+                       help='Glob of paths to skip during search (repeatable)')
+    parser.add_argument('--max-depth', type=int, help='Maximum search depth for --root roots')
+    parser.add_argument('--deep-scan', action='store_true',
+                       help='Also detect Electron/CEF apps by bundled frameworks and Mach-O load commands')
+    parser.add_argument('--metrics-file', type=str,
+                       help='Write a metrics snapshot after the run (.prom for Prometheus textfile, otherwise JSON)')
+    parser.add_argument('--metrics-format', type=str, choices=['prometheus', 'json'],
+                       help='Metrics format (default: by file extension)')
+    parser.add_argument('--plan', action='store_true',
+                       help='Run the command against an in-memory copy of the search roots and print the planned changes')
+    parser.add_argument('--simulate', type=int, metavar='N',
+                       help='Run the command against N generated in-memory applications and report timing')
     
     args = parser.parse_args()
     
     # Создаем патчер с выбранным языком
     patcher = AppPatcher(language=args.lang)
     
+    # Настройка щадящего режима ввода-вывода
+    if args.low_priority:
+        lower_process_priority()
+    if args.throttle_mbps or args.throttle_iops or args.adaptive_throttle:
+        patcher.io_throttle = IOThrottle(args.throttle_mbps, args.throttle_iops, args.adaptive_throttle)
+    
+    patcher.deep_scan = args.deep_scan
+    
+    # Настройка корней поиска
+    if args.roots_config or args.root:
+        roots = []
+        if args.roots_config:
+            try:
+                roots.extend(load_search_roots(args.roots_config))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"❌ Could not load search roots from {args.roots_config}: {e}")
+                return
+        roots.extend(SearchRoot(path, args.max_depth) for path in args.root)
+        patcher.search_roots = roots
+    if args.exclude:
+        if patcher.search_roots is None:
+            patcher.search_roots = [SearchRoot(patcher.applications_dir), SearchRoot(patcher.user_applications_dir)]
+        for root in patcher.search_roots:
+            root.exclude.extend(args.exclude)
+    
+    # Планирование и моделирование выполняются на файловой системе в памяти
+    if args.plan or args.simulate:
+        memory_fs = MemoryFileSystem()
+        if args.simulate:
+            memory_fs.populate_apps(patcher.applications_dir, args.simulate)
+            # Сгенерированное дерево живет до конца запуска: сборщик мусора не должен обходить его снова и снова
+            gc.freeze()
+        else:
+            for root in patcher.get_search_roots():
+                memory_fs.import_from_disk(root.path)
+            memory_fs.import_from_disk(patcher.backup_dir)
+            memory_fs.import_from_disk(patcher.state_dir)
+        patcher.fs = memory_fs
+    
+    # Для --plan/--simulate с --json в stdout попадает только итоговый JSON, ход выполнения - в stderr
+    if args.json and (args.plan or args.simulate):
+        command_output = contextlib.redirect_stdout(sys.stderr)
+    else:
+        command_output = contextlib.nullcontext()
+    
+    started = time.perf_counter()
+    try:
+        with command_output, patcher.durable_batch():
+            run_command(patcher, args)
+    finally:
+        if args.simulate:
+            print_simulation(patcher, args.simulate, time.perf_counter() - started, args.json)
+        elif args.plan:
+            print_plan(patcher, args.json)
+        if args.metrics_file:
+            try:
+                write_metrics(patcher.metrics_snapshot(), args.metrics_file, args.metrics_format)
+            except OSError as e:
+                print(f"⚠️ Warning: Could not write metrics to {args.metrics_file}: {e}")
+
+
+def print_plan(patcher: AppPatcher, as_json: bool = False):
+    """Вывод журнала изменений, накопленного файловой системой в памяти"""
+    journal = patcher.fs.journal
+    if as_json:
+        print(json.dumps([{"op": op, "path": path} for op, path in journal], ensure_ascii=False, indent=2))
+        return
+    if not journal:
+        print(patcher.t("plan_empty"))
+        return
+    print(patcher.t("plan_title", len(journal)))
+    for op, path in journal:
+        print(f"   {op:9} {path}")
+
+
+def print_simulation(patcher: AppPatcher, count: int, elapsed: float, as_json: bool = False):
+    """Итоги прогона на сгенерированных приложениях: время и число операций по типам"""
+    journal = patcher.fs.journal
+    ops: Dict[str, int] = {}
+    for op, _ in journal:
+        ops[op] = ops.get(op, 0) + 1
+    if as_json:
+        print(json.dumps({"apps": count, "seconds": round(elapsed, 3), "operations": ops}, indent=2))
+        return
+    print(patcher.t("simulate_summary", count, len(journal), elapsed))
+    for op, op_count in sorted(ops.items()):
+        print(f"   {op:9} {op_count}")
+
+
+def run_command(patcher: AppPatcher, args: argparse.Namespace):
+    """Выполнение команды, выбранной аргументами командной строки"""
     # Обработка аргументов командной строки
     if args.list:
         print(patcher.t("searching_apps"))
@@ -811,6 +2929,17 @@ def main():
         
         print(patcher.t("done_patching", success_count, len(apps)))
     
+    elif args.apps:
+        # С --json в stdout попадает только JSON, ход выполнения печатается в stderr
+        json_output = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext():
+            results = run_batch(patcher, args)
+        
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2), file=json_output)
+        if not all(result["success"] for result in results):
+            sys.exit(1)
+    
     elif args.app:
         print(f"🔍 Searching for {args.app}...")
         apps = patcher.find_target_applications()
@@ -875,7 +3004,7 @@ def main():
             name, path = found_apps[0]
         
         print(patcher.t("restoring_app", name))
-        if patcher.restore_app(name, path):
+        if patcher.restore_app(name, path, args.generation):
             print(f"✅ {name} successfully restored!")
         else:
             print(f"❌ Error restoring {name}")
@@ -908,6 +3037,82 @@ def main():
         else:
             print(patcher.t("no_patched_apps"))
     
+    elif args.audit:
+        results = patcher.audit_patched_apps()
+        
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        
+        if not results:
+            print(patcher.t("no_patched_apps"))
+            return
+        
+        print(patcher.t("audit_title", len(results)))
+        counts = {"ok": 0, "overwritten": 0, "orphaned": 0, "args-mismatch": 0}
+        for result in results:
+            counts[result["status"]] += 1
+            print(f"   • {result['app']}: {result['status']}")
+        print(patcher.t("audit_summary", counts["ok"], counts["overwritten"],
+                        counts["orphaned"], counts["args-mismatch"]))
+    
+    elif args.smoke_test:
+        results = patcher.smoke_test_patched_apps(args.smoke_timeout)
+        passed = sum(1 for result in results if result["status"] == "pass")
+        
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        elif not results:
+            print(patcher.t("no_patched_apps"))
+        else:
+            print(patcher.t("smoke_title", len(results)))
+            for result in results:
+                status = "✅" if result["status"] == "pass" else "❌"
+                print(f"   {status} {result['app']}: {result['status']}")
+            print(patcher.t("smoke_summary", passed, len(results)))
+        
+        if passed != len(results):
+            sys.exit(1)
+    
+    elif args.snapshot:
+        count = patcher.create_snapshot(args.snapshot)
+        print(patcher.t("snapshot_created", args.snapshot, count))
+    
+    elif args.snapshots:
+        snapshots = patcher.list_snapshots()
+        
+        if args.json:
+            print(json.dumps(snapshots, ensure_ascii=False, indent=2))
+        elif snapshots:
+            for snapshot in snapshots:
+                created = time.strftime("%Y-%m-%d %H:%M", time.localtime(snapshot["created_at"] or 0))
+                print(f"   • {snapshot['name']} ({created}, {snapshot['apps']})")
+        else:
+            print(patcher.t("no_snapshots"))
+    
+    elif args.rollback:
+        results = patcher.rollback_to_snapshot(args.rollback)
+        
+        if results is None:
+            print(patcher.t("snapshot_not_found", args.rollback))
+            sys.exit(1)
+        
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        else:
+            counts = {"rewritten": 0, "unpatched": 0, "unchanged": 0, "error": 0}
+            for result in results:
+                counts[result["action"]] += 1
+                if result["action"] == "error":
+                    print(f"   • {result['app']}: {result['action']} ({result.get('error', '')})")
+                elif result["action"] != "unchanged":
+                    print(f"   • {result['app']}: {result['action']}")
+            print(patcher.t("rollback_summary", args.rollback, counts["rewritten"], counts["unpatched"],
+                            counts["unchanged"], counts["error"]))
+        
+        if any(result["action"] == "error" for result in results):
+            sys.exit(1)
+    
     elif args.cleanup:
         confirm = input(patcher.t("confirm_cleanup")).strip().lower()
         if confirm in ['y', 'yes', 'д', 'да']:
@@ -916,8 +3121,9 @@ def main():
             print(patcher.t("cleanup_cancelled"))
     
     else:
-        # Интерактивный режим
-        interactive_mode(patcher)
+        # Интерактивный режим: сеанс может длиться долго, поэтому состояние пишется после каждого действия
+        with patcher.suspend_durable_batch():
+            interactive_mode(patcher)
 
 
 if __name__ == "__main__":
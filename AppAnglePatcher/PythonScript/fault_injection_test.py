@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Проверка атомарности патчинга: процесс убивается на каждом шаге работы с файлами
+После каждого сбоя bundle должен быть либо полностью исходным, либо полностью запатченным,
+а повторный запуск должен доводить патчинг до конца
+
+Запуск: python3 fault_injection_test.py
+"""
+
+import builtins
+import importlib.util
+import os
+import plistlib
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+MODULE = Path(__file__).resolve().with_name("AppAnglePatcher.py")
+APP_NAME = "Slack"
+MAX_STEPS = 200
+
+# Операции, перед и после которых может произойти сбой
+OS_FUNCTIONS = ("link", "replace", "rename", "chmod", "fsync", "unlink", "open")
+
+
+def make_app(root: Path) -> bytes:
+    """Создание тестового .app bundle, возвращает содержимое исполняемого файла"""
+    contents = root / "Applications" / f"{APP_NAME}.app" / "Contents"
+    (contents / "MacOS").mkdir(parents=True)
+    with open(contents / "Info.plist", 'wb') as f:
+        plistlib.dump({
+            "CFBundleExecutable": APP_NAME,
+            "CFBundleIdentifier": "com.tinyspeck.slackmacgap",
+            "CFBundleVersion": "1.0",
+            "CFBundleShortVersionString": "1.0"
+        }, f)
+    binary = os.urandom(64 * 1024)
+    executable = contents / "MacOS" / APP_NAME
+    executable.write_bytes(binary)
+    executable.chmod(0o755)
+    return binary
+
+
+def run_child(root: Path, kill_at: int):
+    """Патчинг в дочернем процессе с завершением на шаге kill_at (0 - без сбоя)"""
+    spec = importlib.util.spec_from_file_location("AppAnglePatcher", MODULE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    counter = [0]
+
+    def step():
+        counter[0] += 1
+        if counter[0] == kill_at:
+            os._exit(9)
+
+    def wrap(owner, name):
+        original = getattr(owner, name)
+
+        def wrapper(*args, **kwargs):
+            step()
+            result = original(*args, **kwargs)
+            step()
+            return result
+        setattr(owner, name, wrapper)
+
+    for name in OS_FUNCTIONS:
+        wrap(os, name)
+    wrap(builtins, "open")
+
+    patcher = module.AppPatcher()
+    patcher.state_dir = root / "State"
+    patcher.backup_dir = root / "Backups"
+    with patcher.durable_batch():
+        patcher.patch_app(APP_NAME, root / "Applications" / f"{APP_NAME}.app")
+    os._exit(0)
+
+
+def bundle_state(macos_dir: Path, binary: bytes) -> str:
+    """'original' или 'patched'; иначе AssertionError"""
+    executable = macos_dir / APP_NAME
+    original = macos_dir / f"{APP_NAME}.original"
+    assert executable.exists() and os.access(executable, os.X_OK), "executable is missing"
+    data = executable.read_bytes()
+    if data == binary:
+        return "original"
+    assert data.startswith(b"#!/bin/bash"), "executable is neither the binary nor a launcher"
+    assert original.read_bytes() == binary, ".original does not match the binary"
+    return "patched"
+
+
+def main() -> int:
+    if len(sys.argv) == 3:
+        run_child(Path(sys.argv[1]), int(sys.argv[2]))
+
+    failures = 0
+    for kill_at in range(1, MAX_STEPS):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = Path(tmp_dir)
+            binary = make_app(root)
+            macos_dir = root / "Applications" / f"{APP_NAME}.app" / "Contents" / "MacOS"
+
+            returncode = subprocess.run([sys.executable, __file__, str(root), str(kill_at)],
+                                        capture_output=True).returncode
+            try:
+                state = bundle_state(macos_dir, binary)
+
+                # Повторный запуск без сбоя должен завершить патчинг
+                subprocess.run([sys.executable, __file__, str(root), "0"], check=True, capture_output=True)
+                assert bundle_state(macos_dir, binary) == "patched", "re-run did not patch the app"
+                assert not list(macos_dir.glob(".*.tmp")), "temporary files left behind"
+            except AssertionError as e:
+                failures += 1
+                print(f"❌ step {kill_at}: {e}")
+                continue
+
+            print(f"✅ step {kill_at}: {'killed' if returncode else 'completed'}, bundle {state}")
+            if returncode == 0:
+                break
+
+    print(f"{'❌' if failures else '✅'} {failures} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
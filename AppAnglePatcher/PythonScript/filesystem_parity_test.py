@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Сравнение LocalFileSystem и MemoryFileSystem на одном и том же дереве
+Дерево с диска импортируется в память; обход, stat, ссылки, чтение и копирование
+должны давать одинаковый результат, иначе --plan и --simulate расходятся с реальным запуском
+
+Запуск: python3 filesystem_parity_test.py (или pytest)
+"""
+
+import importlib.util
+import os
+import plistlib
+import sys
+import tempfile
+from pathlib import Path
+
+MODULE = Path(__file__).resolve().with_name("AppAnglePatcher.py")
+
+
+def load_module():
+    spec = importlib.util.spec_from_file_location("AppAnglePatcher", MODULE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_tree(root: str):
+    """Bundle с фреймворком как у Electron: Versions/Current и ссылки верхнего уровня"""
+    contents = os.path.join(root, "Apps", "Foo.app", "Contents")
+    framework = os.path.join(contents, "Frameworks", "Electron Framework.framework")
+    version_a = os.path.join(framework, "Versions", "A")
+    os.makedirs(os.path.join(contents, "MacOS"))
+    os.makedirs(os.path.join(version_a, "Resources"))
+
+    with open(os.path.join(contents, "Info.plist"), 'wb') as f:
+        plistlib.dump({"CFBundleExecutable": "Foo", "CFBundleIdentifier": "com.example.foo",
+                       "CFBundleVersion": "1.0", "CFBundleShortVersionString": "1.0"}, f)
+    executable = os.path.join(contents, "MacOS", "Foo")
+    with open(executable, 'wb') as f:
+        f.write(b"\xcf\xfa\xed\xfe" + os.urandom(1024))
+    os.chmod(executable, 0o755)
+    os.link(executable, executable + ".original")
+
+    with open(os.path.join(version_a, "Electron Framework"), 'wb') as f:
+        f.write(os.urandom(2048))
+    with open(os.path.join(version_a, "Resources", "app.pak"), 'wb') as f:
+        f.write(os.urandom(512))
+    os.symlink("A", os.path.join(framework, "Versions", "Current"))
+    os.symlink("Versions/Current/Electron Framework", os.path.join(framework, "Electron Framework"))
+    os.symlink("Versions/Current/Resources", os.path.join(framework, "Resources"))
+
+    # Висячая ссылка вне bundle: shutil.copytree на ней падает, поэтому копирование проверяем только для .app
+    extras = os.path.join(root, "Apps", "Extras")
+    os.makedirs(extras)
+    os.symlink("missing-target", os.path.join(extras, "dangling"))
+
+
+def describe_walk(fs, top: str):
+    """Обход в сравнимом виде: относительные пути и отсортированные списки"""
+    result = []
+    for current, dirs, files in fs.walk(top):
+        result.append((os.path.relpath(current, top), sorted(dirs), sorted(files)))
+    return sorted(result)
+
+
+def describe_entry(fs, path: str):
+    """
+    Наблюдаемые свойства пути
+    Без номера inode (в памяти он свой) и размера директорий (зависит от файловой системы)
+    """
+    info = {
+        "exists": fs.exists(path),
+        "is_dir": fs.is_dir(path),
+        "is_dir_nofollow": fs.is_dir(path, follow_symlinks=False),
+        "realpath": fs.realpath(path),
+    }
+    st = fs.stat(path, follow_symlinks=False)
+    info["lstat"] = (None if info["is_dir_nofollow"] else st.st_size, st.st_mtime_ns, st.st_mode)
+    if info["exists"]:
+        st = fs.stat(path)
+        info["stat"] = (None if info["is_dir"] else st.st_size, st.st_mtime_ns, st.st_mode)
+        if info["is_dir"]:
+            info["listdir"] = sorted(fs.listdir(path))
+            info["subdirs"] = sorted(fs.list_subdirs(path))
+            info["subdirs_follow"] = sorted(fs.list_subdirs(path, follow_symlinks=True))
+        else:
+            info["data"] = fs.read_bytes(path)
+            info["region"] = fs.read_region(path, 4, 16)
+    return info
+
+
+def all_paths(fs, top: str):
+    paths = [top]
+    for current, dirs, files in fs.walk(top):
+        paths.extend(os.path.join(current, name) for name in dirs + files)
+    return sorted(paths)
+
+
+def compare(module, root: str):
+    """Список расхождений между дисковой и импортированной файловой системой"""
+    local_fs = module.LocalFileSystem()
+    memory_fs = module.MemoryFileSystem()
+    memory_fs.import_from_disk(root)
+    mismatches = []
+
+    apps = os.path.join(root, "Apps")
+    if describe_walk(local_fs, apps) != describe_walk(memory_fs, apps):
+        mismatches.append(("walk", describe_walk(local_fs, apps), describe_walk(memory_fs, apps)))
+
+    for path in all_paths(local_fs, apps):
+        local_info, memory_info = describe_entry(local_fs, path), describe_entry(memory_fs, path)
+        for key in local_info.keys() | memory_info.keys():
+            if local_info.get(key) != memory_info.get(key):
+                mismatches.append((f"{key}: {os.path.relpath(path, root)}", local_info.get(key), memory_info.get(key)))
+
+    executable = os.path.join(apps, "Foo.app", "Contents", "MacOS", "Foo")
+    if not memory_fs.samefile(executable, executable + ".original"):
+        mismatches.append(("samefile: hardlink", True, False))
+
+    # Отпечаток дерева решает, переиспользовать ли резервную копию: --plan должен предсказывать то же
+    app_path = Path(apps) / "Foo.app"
+    patchers = {}
+    for name, fs in (("local", local_fs), ("memory", memory_fs)):
+        patchers[name] = module.AppPatcher()
+        patchers[name].fs = fs
+    fingerprints = {name: patcher._tree_fingerprint(app_path) for name, patcher in patchers.items()}
+    if fingerprints["local"] != fingerprints["memory"]:
+        mismatches.append(("tree fingerprint", fingerprints["local"], fingerprints["memory"]))
+
+    copy_path = os.path.join(root, "Copy.app")
+    local_bytes = local_fs.copytree(app_path, copy_path)
+    memory_bytes = memory_fs.copytree(app_path, copy_path)
+    if local_bytes != memory_bytes:
+        mismatches.append(("copytree bytes", local_bytes, memory_bytes))
+    if describe_walk(local_fs, copy_path) != describe_walk(memory_fs, copy_path):
+        mismatches.append(("copytree walk", describe_walk(local_fs, copy_path), describe_walk(memory_fs, copy_path)))
+    copy_fingerprints = {name: patcher._tree_fingerprint(Path(copy_path)) for name, patcher in patchers.items()}
+    if copy_fingerprints["local"] != copy_fingerprints["memory"]:
+        mismatches.append(("copytree fingerprint", copy_fingerprints["local"], copy_fingerprints["memory"]))
+
+    return mismatches
+
+
+def test_filesystem_parity():
+    module = load_module()
+    with tempfile.TemporaryDirectory(prefix="appangle-parity-") as tmp_dir:
+        root = os.path.realpath(tmp_dir)
+        make_tree(root)
+        mismatches = compare(module, root)
+    assert not mismatches, mismatches
+
+
+def main() -> int:
+    module = load_module()
+    with tempfile.TemporaryDirectory(prefix="appangle-parity-") as tmp_dir:
+        root = os.path.realpath(tmp_dir)
+        make_tree(root)
+        mismatches = compare(module, root)
+
+    for what, local_value, memory_value in mismatches:
+        print(f"❌ {what}\n   local:  {local_value!r}\n   memory: {memory_value!r}")
+    print(f"{'❌' if mismatches else '✅'} {len(mismatches)} mismatch(es)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())